@@ -1,5 +1,4 @@
 import os
-import yaml
 import logging
 import logging.config
 
@@ -15,6 +14,7 @@ def init_logging(cfg_path=None, level=logging.INFO):
     global _logging_initialized
     if not _logging_initialized:
         if cfg_path is not None and os.path.exists(cfg_path):
+            import yaml
             with open(cfg_path, 'rt') as f:
                 config = yaml.safe_load(f.read())
             logging.config.dictConfig(config)
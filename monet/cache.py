@@ -0,0 +1,179 @@
+# Cache of derived analysis products (smoothed centerlines, peak tables, trajectories ...) in npz/npy files,
+# keyed by the identity of the source file and the parameters that produced them
+from __future__ import print_function, absolute_import
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+_EXTENSIONS = (".npz", ".npy")
+
+
+def file_identity(path):
+    """
+    (absolute path, size, mtime in ns) of the file, any rewrite of the source changes it.
+    A stat call, so a cache hit costs no more than opening the product.
+    """
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+class AnalysisCache(object):
+    """
+    Products are stored as {name}_{key}.npz (.npy if memory-mapped) in cache_dir,
+    where key hashes the source file identity and parameters.
+    max_bytes: least recently used products are evicted when the cache grows beyond it, no limit if None
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name, source, params=None):
+        payload = json.dumps({"name": name, "source": file_identity(source), "params": params or {}},
+                             sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()[:20]
+
+    def path(self, name, source, params=None, ext=".npz"):
+        return os.path.join(self.cache_dir, "%s_%s%s" % (name, self.key(name, source, params), ext))
+
+    def cached(self, name, source, params, compute):
+        """
+        Return the product `name` of `source` with `params`, call compute() and store its result on a miss.
+        compute returns an array, or a dict of arrays.
+        """
+        npz_file = self.path(name, source, params)
+        if os.path.exists(npz_file):
+            _logger.debug("Cache hit %s" % npz_file)
+            # touch for LRU eviction
+            os.utime(npz_file, None)
+            with np.load(npz_file) as data:
+                if data.files == ["__array__"]:
+                    return data["__array__"]
+                return {k: data[k] for k in data.files}
+
+        _logger.info("Cache miss %s for %s %s, computing ..." % (name, source, params))
+        result = compute()
+        arrays = result if isinstance(result, dict) else {"__array__": result}
+        tmp_file = npz_file + ".tmp.npz"
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, npz_file)
+        self.evict()
+        return result
+
+    def cached_memmap(self, name, source, params, shape, dtype, fill):
+        """
+        Like cached, for an array larger than memory: on a miss fill(out) writes it into a memory-mapped
+        .npy file of the given shape and dtype, piece by piece. Returns the product memory-mapped read-only.
+        """
+        npy_file = self.path(name, source, params, ext=".npy")
+        if os.path.exists(npy_file):
+            _logger.debug("Cache hit %s" % npy_file)
+            os.utime(npy_file, None)
+            return np.load(npy_file, mmap_mode="r")
+
+        _logger.info("Cache miss %s for %s %s, computing ..." % (name, source, params))
+        tmp_file = npy_file + ".tmp.npy"
+        out = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=dtype, shape=shape)
+        fill(out)
+        out.flush()
+        del out
+        os.replace(tmp_file, npy_file)
+        self.evict()
+        return np.load(npy_file, mmap_mode="r")
+
+    def _files(self):
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(_EXTENSIONS)]
+
+    def size(self):
+        return sum(os.path.getsize(f) for f in self._files())
+
+    def evict(self):
+        """remove least recently used products until the cache fits in max_bytes"""
+        if self.max_bytes is None:
+            return
+        files = self._files()
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        # always keep the newest product
+        for f in files[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(f)
+            _logger.info("Evict %s from cache" % f)
+            os.remove(f)
+
+    def clear(self):
+        for f in self._files():
+            os.remove(f)
+
+    # centerline products
+
+    def smoothed_center_line(self, h5_file, scale=1., window=51, polyorder=3, gx_ds="gx", chunk_size=256):
+        """
+        savgol_filter of every temporal snapshot G[:, t], as a read-only memory-mapped [space] x [time] array.
+        It is computed and written one time chunk at a time, the recording is never in memory as a whole.
+        """
+        import h5py
+        from monet.centerline import center_line_shape, iter_smoothed
+        params = {"scale": scale, "window": window, "polyorder": polyorder, "gx_ds": gx_ds}
+        n_s, n_t = center_line_shape(h5_file, gx_ds=gx_ds)
+        with h5py.File(h5_file, 'r') as f:
+            src_dtype = f[gx_ds].dtype
+        dtype = np.float32 if src_dtype == np.float32 else np.float64
+
+        def fill(out):
+            for t0, t1, smoothed in iter_smoothed(h5_file, window, polyorder, chunk_size=chunk_size, gx_ds=gx_ds,
+                                                  scale=scale):
+                out[t0:t1] = smoothed.T
+        # stored snapshot by snapshot, so G_hat[:, t] reads contiguous memory
+        return self.cached_memmap("smoothed", h5_file, params, (n_t, n_s), dtype, fill).T
+
+    def center_line_peaks(self, h5_file, scale=1., window=51, polyorder=3, height=0.01, distance=50, mean=None,
+                          gx_ds="gx"):
+        """
+        peak table of monet.centerline.peak_table, mean as in monet.centerline.iter_peaks,
+        or "in_memory" to detrend by G.mean() computed exactly as the scripts do (read_center_line_h5(...) * scale),
+        which loads the recording once on a miss.
+        """
+        from monet.centerline import peak_table
+        params = {"scale": scale, "window": window, "polyorder": polyorder, "height": height,
+                  "distance": distance, "mean": mean, "gx_ds": gx_ds}
+
+        def compute():
+            offset = mean
+            if isinstance(mean, str):
+                if mean != "in_memory":
+                    raise ValueError("mean must be a number, None or 'in_memory', got %s" % mean)
+                from monet.io import read_center_line_h5
+                offset = (read_center_line_h5(h5_file, gx_ds=gx_ds) * scale).mean()
+            return peak_table(h5_file, window=window, polyorder=polyorder, height=height, distance=distance,
+                              mean=offset, gx_ds=gx_ds, scale=scale)
+        return self.cached("peaks", h5_file, params, compute)
+
+    def trajectory(self, h5_file, params, track):
+        """a tracked trajectory, track() computes it from scratch and params identify it"""
+        return self.cached("trajectory", h5_file, params, track)
+
+
+def _prefetch(cache_dir, h5_file, products, scale, window, polyorder, height, distance, mean):
+    cache = AnalysisCache(cache_dir)
+    if "smoothed" in products:
+        cache.smoothed_center_line(h5_file, scale, window, polyorder)
+    if "peaks" in products:
+        cache.center_line_peaks(h5_file, scale, window, polyorder, height, distance, mean=mean)
+
+
+def prefetch_center_lines(cache, h5_files, products=("smoothed", "peaks"), scale=1., window=51,
+                          polyorder=3, height=0.01, distance=50, mean=None, n_jobs=-1):
+    """
+    compute the centerline products of several recordings (e.g. one per strain rate) in parallel,
+    with the same arguments the script passes afterwards so that it hits the cache
+    """
+    from joblib import Parallel, delayed
+    Parallel(n_jobs=n_jobs)(delayed(_prefetch)(cache.cache_dir, f, products, scale, window, polyorder, height,
+                                               distance, mean) for f in h5_files)
+    cache.evict()
@@ -0,0 +1,127 @@
+# Out-of-core processing of centerline recordings: [space steps] x [time steps] matrices streamed in time chunks
+from __future__ import print_function, absolute_import
+import logging
+import h5py
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+def center_line_shape(h5_file, gx_ds="gx", t_axis=1):
+    """return (space steps, time steps) of the centerline data set"""
+    with h5py.File(h5_file, 'r') as f:
+        shape = f[gx_ds].shape
+    return (shape[1], shape[0]) if t_axis == 0 else shape
+
+
+def iter_time_chunks(h5_file, chunk_size=256, overlap=0, gx_ds="gx", t_axis=1, scale=1., t_range=None,
+                     min_block=0):
+    """
+    Stream the centerline data set in time chunks, only one chunk is in memory at a time.
+    Yields (t0, t1, block, offset): block is G[:, t0 - offset: t1 + overlap] as [space] x [time],
+    extended by up to `overlap` time steps on each side (clipped to the recording),
+    so block[:, offset: offset + t1 - t0] is the chunk itself.
+    t_range: (start, stop) time steps to cover, the whole recording if None
+    min_block: blocks are widened to at least this many time steps (if the recording is that long)
+    """
+    with h5py.File(h5_file, 'r') as f:
+        ds = f[gx_ds]
+        n_t = ds.shape[t_axis]
+        t_start, t_stop = (0, n_t) if t_range is None else t_range
+        t_start, t_stop = max(0, t_start), min(n_t, t_stop)
+        for t0 in range(t_start, t_stop, chunk_size):
+            t1 = min(t0 + chunk_size, t_stop)
+            b0 = max(0, t0 - overlap)
+            b1 = min(n_t, t1 + overlap)
+            if b1 - b0 < min_block:
+                b1 = min(n_t, b0 + min_block)
+                b0 = max(0, b1 - min_block)
+            if t_axis == 0:
+                block = np.array(ds[b0:b1, :]).T
+            else:
+                block = np.array(ds[:, b0:b1])
+            yield t0, t1, block * scale if scale != 1 else block, t0 - b0
+
+
+def center_line_stats(h5_file, chunk_size=256, gx_ds="gx", t_axis=1, scale=1.):
+    """
+    mean, std, min and max of the whole (scaled) centerline data set, computed chunk by chunk in float64.
+    The mean is not bitwise G.mean(): numpy sums float32 data in float32, and in another order.
+    Chunks are merged with Chan's update of the mean and squared deviations, stable unlike E[x^2] - mean^2.
+    """
+    count, mean, m2 = 0, 0., 0.
+    g_min, g_max = np.inf, -np.inf
+    for _, _, block, _ in iter_time_chunks(h5_file, chunk_size, gx_ds=gx_ds, t_axis=t_axis, scale=scale):
+        block = block.astype(np.float64)
+        n = block.size
+        block_mean = block.mean()
+        block_m2 = ((block - block_mean) ** 2).sum()
+        delta = block_mean - mean
+        total = count + n
+        mean += delta * n / total
+        m2 += block_m2 + delta ** 2 * count * n / total
+        count = total
+        g_min = min(g_min, block.min())
+        g_max = max(g_max, block.max())
+    return {"mean": mean, "std": np.sqrt(m2 / count), "min": g_min, "max": g_max, "count": count}
+
+
+def iter_smoothed(h5_file, window=51, polyorder=3, axis="space", chunk_size=256, gx_ds="gx", t_axis=1, scale=1.,
+                  t_range=None):
+    """
+    Savitzky-Golay smoothing of the centerline data, streamed in time chunks.
+    axis="space" smooths each temporal snapshot (as savgol_filter(G[:, t], ...)),
+    axis="time" smooths each position over time, any chunk_size works.
+    Yields (t0, t1, smoothed) with smoothed equal to the in-memory result for G[:, t0:t1].
+    """
+    from scipy.signal import savgol_filter
+    if axis not in ("space", "time"):
+        raise ValueError("axis must be 'space' or 'time', got %s" % axis)
+    # along time, blocks overlap by half a window, and near the ends of the recording they hold at least
+    # a whole window, which savgol_filter fits to the edge samples
+    overlap = window // 2 if axis == "time" else 0
+    min_block = window if axis == "time" else 0
+    for t0, t1, block, offset in iter_time_chunks(h5_file, chunk_size, overlap=overlap, gx_ds=gx_ds,
+                                                  t_axis=t_axis, scale=scale, t_range=t_range,
+                                                  min_block=min_block):
+        if axis == "space":
+            # one snapshot at a time, the batched 2d filter differs from the 1d one in the last bits
+            block = block[:, offset: offset + t1 - t0]
+            # savgol_filter keeps float32, so does Yhat - G.mean() in the scripts
+            smoothed = np.empty(block.shape, dtype=block.dtype if block.dtype == np.float32 else np.float64)
+            for k in range(block.shape[1]):
+                smoothed[:, k] = savgol_filter(block[:, k], window, polyorder)
+            yield t0, t1, smoothed
+        else:
+            smoothed = savgol_filter(block, window, polyorder, axis=1)
+            yield t0, t1, smoothed[:, offset: offset + t1 - t0]
+
+
+def iter_peaks(h5_file, window=51, polyorder=3, height=0.01, distance=50, mean=None, chunk_size=256, gx_ds="gx",
+               t_axis=1, scale=1., t_range=None):
+    """
+    Peak detection on each smoothed temporal snapshot, as in the evolution scripts:
+    find_peaks(savgol_filter(G[:, t], window, polyorder) - G.mean(), height=height, distance=distance)
+    mean: detrending offset. Pass G.mean() to get the scripts' peaks exactly, with None it is computed by
+        center_line_stats, which can differ from it in the last bits and move a peak sitting on the threshold.
+    Yields (t, Yhat, peaks) one time step at a time.
+    """
+    from scipy.signal import find_peaks
+    if mean is None:
+        mean = center_line_stats(h5_file, chunk_size, gx_ds=gx_ds, t_axis=t_axis, scale=scale)["mean"]
+    for t0, _, smoothed in iter_smoothed(h5_file, window, polyorder, axis="space", chunk_size=chunk_size,
+                                         gx_ds=gx_ds, t_axis=t_axis, scale=scale, t_range=t_range):
+        for k in range(smoothed.shape[1]):
+            Yhat = smoothed[:, k]
+            peaks, _ = find_peaks(Yhat - mean, height=height, distance=distance)
+            yield t0 + k, Yhat, peaks
+
+
+def peak_table(h5_file, **kwargs):
+    """
+    All peaks of iter_peaks as one table, a structured array with fields t, pos and value (smoothed gradient).
+    """
+    rows = []
+    for t, Yhat, peaks in iter_peaks(h5_file, **kwargs):
+        rows.extend((t, p, Yhat[p]) for p in peaks)
+    return np.array(rows, dtype=[("t", np.int64), ("pos", np.int64), ("value", np.float64)])
@@ -4,9 +4,6 @@ import logging
 import numba
 import numpy as np
 
-from scipy import sparse
-from joblib import Parallel, delayed
-
 _logger = logging.getLogger(__name__)
 
 
@@ -18,6 +15,7 @@ def build_A(M, N):
         E 0
     ]
     """
+    from scipy import sparse
     Qmat = build_Q(M, N)
     Emat = build_E(M, N)    
     Emat_t = Emat.transpose(copy=True)
@@ -27,6 +25,7 @@ def build_A(M, N):
 
 def build_Q(M, N):
     """build quadratic matrix for MxN pixels"""
+    from scipy import sparse
     Q = sparse.identity(2 * M * N, dtype=np.int16)
     _logger.info("Built a Q matrix of size (%d, %d)" % (Q.shape[0], Q.shape[1]))
     return Q
@@ -34,6 +33,7 @@ def build_Q(M, N):
 
 def build_E(M, N):
     """build the compatibility constraint matrix"""
+    from scipy import sparse
     Emat = None
     for i in range(M - 1):
         _logger.info("Building E matrix for i=%d" % i)
@@ -45,8 +45,28 @@ def build_E(M, N):
     return Emat
 
 
+def assemble_E(M, N, dtype=np.float64):
+    """
+    vectorized build of the same compatibility constraint matrix as build_E,
+    one row per quadruple (i, j), in the same row order
+    """
+    from scipy import sparse
+    i, j = np.meshgrid(np.arange(M - 1), np.arange(N - 1), indexing="ij")
+    i, j = i.ravel(), j.ravel()
+    u1 = i * N + j
+    u3 = u1 + 1
+    v1 = u1 + M * N
+    v2 = v1 + N
+    rows = np.repeat(np.arange(i.size), 4)
+    cols = np.stack([u1, v2, u3, v1], axis=1).ravel()
+    data = np.tile(np.array([1, 1, -1, -1], dtype=dtype), i.size)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(i.size, 2 * M * N))
+
+
 def build_E_i(I, M, N):
     """build the compatibility constraint matrix for i=I"""
+    from scipy import sparse
+    from joblib import Parallel, delayed
     Smat = None
     grp_size = 1000
     for grp in range(np.ceil((N - 1)/grp_size).astype(np.int)):
@@ -62,11 +82,12 @@ def build_E_i(I, M, N):
 
 
 def build_quadruple(i, j, M, N):
+    from scipy import sparse
     row, col, data = build_quadruple_data(i, j, M, N)
     return sparse.coo_matrix((data, (row, col)), shape=(1, 2 * M * N), dtype=np.int16)
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def build_quadruple_data(i, j, M, N):
     """
     return rows, cols, and data for one compatibility equation:
@@ -89,12 +110,12 @@ def build_quadruple_data(i, j, M, N):
     return row, col, data
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def uij(i, j, M, N):
     return i * N + j
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def vij(i, j, M, N):
     return uij(i, j, M, N) + (M * N)
 
@@ -105,6 +126,7 @@ if __name__ == "__main__":
     prj_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     sys.path.insert(0, prj_root)
 
+    from scipy import sparse
     from monet import init_logging
     init_logging()
 
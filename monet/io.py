@@ -1,12 +1,21 @@
+import io
+import logging
 import h5py
 import numpy as np
 
+_logger = logging.getLogger(__name__)
+
+# lossy storage of float fields, see write_field
+STORAGE_MODES = ("scaleoffset", "quantize", "float16")
+# stands for NaN in scaleoffset storage, the filter keeps the fill value exact
+_SCALEOFFSET_FILL = np.finfo(np.float32).max
+
 
 def read_h5(h5_file, gx_ds="gradz_x", gy_ds="gradz_y"):
     with h5py.File(h5_file, 'r') as gh5:
-        gX = np.array(gh5[gx_ds])
+        gX = read_field(gh5, gx_ds)
         if gy_ds in gh5:
-            gY = np.array(gh5[gy_ds])
+            gY = read_field(gh5, gy_ds)
         else:
             gY = np.zeros(gX.shape)
     return gX, gY
@@ -17,4 +26,110 @@ def read_center_line_h5(h5_file, gx_ds="gx"):
     each row or column is a temporal snapshot, the other dimension is the "time direction"
     """
     with h5py.File(h5_file, 'r') as f:
-        return np.array(f['gx'])
+        return np.array(f[gx_ds])
+
+
+def write_field(h5, name, data, precision=None, mode="scaleoffset"):
+    """
+    Write a float field into an open h5 file, keeping only the given absolute precision.
+    precision: maximum absolute error, None to store full float32
+    mode:
+        "scaleoffset"  HDF5 scale-offset filter keeping enough decimal digits, plus gzip.
+                       Decoded by HDF5 itself, so any reader (e.g. ParaView) sees float32.
+                       NaN is stored as the largest float32 (the "missing_value" attribute), read_field restores it.
+                       HDF5 scales in float32, so large values err by more than the kept digits suggest.
+        "quantize"     uint16 (uint32 if the range needs it) levels of about 2 * precision, plus shuffle and gzip,
+                       with scale_factor and add_offset attributes, decoded by read_field
+        "float16"      half floats, the error is relative to the magnitude
+    The stored data is decoded again and its maximum error recorded in the "error_bound" attribute, with the mode
+    in "storage". ValueError if the error exceeds precision (use a finer mode, or no precision).
+    NaN is kept as missing in every mode, infinite values cannot be stored within a bound and raise ValueError.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    if precision is None:
+        return h5.create_dataset(name, data=data)
+    if mode not in STORAGE_MODES:
+        raise ValueError("Unknown storage mode %s, expecting one of %s" % (mode, STORAGE_MODES))
+    if np.isinf(data).any():
+        raise ValueError("Cannot store infinite values of %s with precision %g" % (name, precision))
+
+    finite = np.isfinite(data)
+    if mode == "scaleoffset":
+        digits = max(0, int(np.ceil(-np.log10(precision))))
+        missing = np.isnan(data)
+        if missing.any():
+            # the filter does not handle NaN, but leaves the fill value untouched
+            stored = np.where(missing, _SCALEOFFSET_FILL, data)
+            options = {"scaleoffset": digits, "compression": "gzip", "fillvalue": _SCALEOFFSET_FILL}
+        else:
+            stored = data
+            options = {"scaleoffset": digits, "compression": "gzip"}
+        decoded = _hdf5_round_trip(stored, options)
+    elif mode == "quantize":
+        offset = float(data[finite].min()) if finite.any() else 0.
+        # levels half a step apart from any value, less the float32 rounding of decoding
+        rounding = float(np.spacing(np.float32(np.abs(data[finite]).max()))) if finite.any() else 0.
+        if rounding >= precision:
+            raise ValueError("Precision %g is finer than float32 for the values of %s" % (precision, name))
+        scale = 2. * (precision - rounding)
+        levels = np.round((data.astype(np.float64) - offset) / scale)
+        top = levels[finite].max() if finite.any() else 0
+        dtype = np.uint16 if top < np.iinfo(np.uint16).max else np.uint32
+        if top >= np.iinfo(np.uint32).max:
+            raise ValueError("Precision %g is too fine to quantize %s into 32 bits" % (precision, name))
+        # the largest level marks missing values
+        stored = np.where(finite, levels, np.iinfo(dtype).max).astype(dtype)
+        options = {"shuffle": True, "compression": "gzip"}
+        # as read_field decodes it
+        decoded = (stored * scale + offset).astype(np.float32)
+    else:
+        if finite.any() and np.abs(data[finite]).max() > np.finfo(np.float16).max:
+            raise ValueError("%s has values up to %.3e, beyond the float16 range" % (
+                name, float(np.abs(data[finite]).max())))
+        stored = data.astype(np.float16)
+        options = {"shuffle": True, "compression": "gzip"}
+        decoded = stored.astype(np.float32)
+
+    error_bound = float(np.abs(decoded[finite].astype(np.float64) - data[finite]).max()) if finite.any() else 0.
+    if not error_bound <= precision:
+        raise ValueError("%s storage of %s errs by %.3e (values up to %.3e), above the requested %.3e" % (
+            mode, name, error_bound, float(np.abs(data[finite]).max()), precision))
+    ds = h5.create_dataset(name, data=stored, **options)
+    if "fillvalue" in options:
+        ds.attrs["missing_value"] = _SCALEOFFSET_FILL
+    elif mode == "quantize":
+        ds.attrs["scale_factor"] = scale
+        ds.attrs["add_offset"] = offset
+    ds.attrs["storage"] = mode
+    ds.attrs["error_bound"] = error_bound
+    return ds
+
+
+def _hdf5_round_trip(data, options):
+    """
+    data as read back after writing it with the dataset options (filters) into a closed file.
+    Reading from the file it was written to returns HDF5's cached chunks, before encoding.
+    """
+    buf = io.BytesIO()
+    with h5py.File(buf, 'w') as h5:
+        h5.create_dataset("data", data=data, **options)
+    with h5py.File(buf, 'r') as h5:
+        return h5["data"][()]
+
+
+def read_field(h5, name):
+    """read a data set written by write_field, lossy storage is decoded back to float32"""
+    ds = h5[name]
+    data = np.array(ds)
+    storage = ds.attrs.get("storage")
+    if isinstance(storage, bytes):
+        storage = storage.decode()
+    if storage == "quantize":
+        missing = data == np.iinfo(data.dtype).max
+        data = (data * ds.attrs["scale_factor"] + ds.attrs["add_offset"]).astype(np.float32)
+        data[missing] = np.nan
+    elif storage == "float16":
+        data = data.astype(np.float32)
+    elif "missing_value" in ds.attrs:
+        data[data == ds.attrs["missing_value"]] = np.nan
+    return data
@@ -0,0 +1,90 @@
+# Compiled numba kernels, imported lazily so that importing monet stays cheap.
+# Kernels are cached on disk (cache=True), new worker processes load them instead of recompiling.
+from __future__ import print_function, absolute_import
+import numba
+import numpy as np
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def integrate_stack(gX, gY, pivot_rows, pivot_cols, Z):
+    F, M, N = gX.shape
+    scale = 1. / (len(pivot_rows) + len(pivot_cols))
+    for f in numba.prange(F):
+        Z[f, :, :] = 0
+        down = np.empty(N)
+        up = np.empty(N)
+        # row pivots: down column 0 to row p, along row p, then up/down every column
+        for p in pivot_rows:
+            z = 0.
+            for k in range(p):
+                z += gX[f, k, 0]
+            for j in range(N):
+                if j > 0:
+                    z += gY[f, p, j - 1]
+                down[j] = z
+                up[j] = z
+                Z[f, p, j] += z
+            for i in range(p + 1, M):
+                for j in range(N):
+                    down[j] += gX[f, i - 1, j]
+                    Z[f, i, j] += down[j]
+            for i in range(p - 1, -1, -1):
+                for j in range(N):
+                    up[j] -= gX[f, i, j]
+                    Z[f, i, j] += up[j]
+        # column pivots: along row 0 to column q, down column q, then left/right every row
+        for q in pivot_cols:
+            z = 0.
+            for k in range(q):
+                z += gY[f, 0, k]
+            for i in range(M):
+                if i > 0:
+                    z += gX[f, i - 1, q]
+                zz = z
+                Z[f, i, q] += zz
+                for j in range(q + 1, N):
+                    zz += gY[f, i, j - 1]
+                    Z[f, i, j] += zz
+                zz = z
+                for j in range(q - 1, -1, -1):
+                    zz -= gY[f, i, j]
+                    Z[f, i, j] += zz
+        for i in range(M):
+            for j in range(N):
+                Z[f, i, j] *= scale
+
+
+@numba.jit(nopython=True, cache=True)
+def lu_solve(L_data, L_indices, L_indptr, U_data, U_indices, U_indptr, perm_r, perm_c, b):
+    """
+    Solve A x = b from a superlu factorization Pr A Pc = L U, with L and U given as csc arrays,
+    so a factor held in shared or memory-mapped arrays can be used without copying it.
+    """
+    n = b.shape[0]
+    y = np.empty(n)
+    for i in range(n):
+        y[perm_r[i]] = b[i]
+    # forward substitution, column by column
+    for j in range(n):
+        diag = 1.
+        for k in range(L_indptr[j], L_indptr[j + 1]):
+            if L_indices[k] == j:
+                diag = L_data[k]
+        y[j] /= diag
+        for k in range(L_indptr[j], L_indptr[j + 1]):
+            if L_indices[k] > j:
+                y[L_indices[k]] -= L_data[k] * y[j]
+    # backward substitution
+    for j in range(n - 1, -1, -1):
+        diag = 1.
+        for k in range(U_indptr[j], U_indptr[j + 1]):
+            if U_indices[k] == j:
+                diag = U_data[k]
+        y[j] /= diag
+        for k in range(U_indptr[j], U_indptr[j + 1]):
+            if U_indices[k] < j:
+                y[U_indices[k]] -= U_data[k] * y[j]
+    x = np.empty(n)
+    for i in range(n):
+        x[i] = y[perm_c[i]]
+    return x
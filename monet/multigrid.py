@@ -0,0 +1,181 @@
+# Matrix-free solver of the compatibility system on the pixel grid
+#
+# With Q = I the KKT system reduces to E E^T l = E b, x = b - E^T l,
+# and E E^T is the 5-point Laplacian (Dirichlet boundary) on the (M-1)x(N-1) quadruples.
+# E, E^T and the Laplacian are applied as stencils on arrays, and the Laplacian is solved by
+# conjugate gradient preconditioned with a geometric multigrid V-cycle.
+# Every function works on a single (M, N) frame or an (F, M, N) stack.
+from __future__ import print_function, absolute_import
+import logging
+import numpy as np
+
+from functools import lru_cache
+from monet.reconstruct import compatibility_residual
+
+_logger = logging.getLogger(__name__)
+
+# damped Jacobi weight, optimal smoothing for the 5-point Laplacian
+_OMEGA = 0.8
+_COARSEST = 64
+
+
+def apply_E(gX, gY):
+    """the compatibility constraint matrix applied to the (gX, gY) pixel fields"""
+    return compatibility_residual(gX, gY)
+
+
+def apply_Et(lam):
+    """transpose of E, from (..., M-1, N-1) multipliers to (..., M, N) pixel fields"""
+    shape = lam.shape[:-2] + (lam.shape[-2] + 1, lam.shape[-1] + 1)
+    u = np.zeros(shape)
+    v = np.zeros(shape)
+    u[..., :-1, :-1] += lam
+    u[..., :-1, 1:] -= lam
+    v[..., 1:, :-1] += lam
+    v[..., :-1, :-1] -= lam
+    return u, v
+
+
+def _laplacian(x, ax, ay):
+    """5-point Laplacian with zero boundary, ax and ay are the coefficients along each axis"""
+    y = (2 * (ax + ay)) * x
+    y[..., 1:, :] -= ax * x[..., :-1, :]
+    y[..., :-1, :] -= ax * x[..., 1:, :]
+    y[..., :, 1:] -= ay * x[..., :, :-1]
+    y[..., :, :-1] -= ay * x[..., :, 1:]
+    return y
+
+
+def _restrict(f, axis):
+    """full weighting along one axis, fine point 2k+1 becomes coarse point k"""
+    f = np.moveaxis(f, axis, -1)
+    c = 0.25 * f[..., 0:-2:2] + 0.5 * f[..., 1:-1:2] + 0.25 * f[..., 2::2]
+    return np.moveaxis(c, -1, axis)
+
+
+def _prolong(c, axis, m):
+    """linear interpolation along one axis to m fine points, 2x the transpose of _restrict"""
+    c = np.moveaxis(c, axis, -1)
+    f = np.zeros(c.shape[:-1] + (m,))
+    mc = c.shape[-1]
+    f[..., 1:2 * mc:2] += c
+    f[..., 0:2 * mc:2] += 0.5 * c
+    f[..., 2:2 * mc + 1:2] += 0.5 * c
+    return np.moveaxis(f, -1, axis)
+
+
+class _Level(object):
+
+    def __init__(self, m, n, ax, ay):
+        self.m = m
+        self.n = n
+        self.ax = ax
+        self.ay = ay
+        # axes are coarsened while they have at least 3 points, the other one is kept (semi-coarsening)
+        self.coarsen_x = m >= 3
+        self.coarsen_y = n >= 3
+
+
+def _build_levels(m, n):
+    levels = [_Level(m, n, 1., 1.)]
+    while levels[-1].m * levels[-1].n > _COARSEST and (levels[-1].coarsen_x or levels[-1].coarsen_y):
+        lv = levels[-1]
+        levels.append(_Level((lv.m - 1) // 2 if lv.coarsen_x else lv.m,
+                             (lv.n - 1) // 2 if lv.coarsen_y else lv.n,
+                             lv.ax / 4 if lv.coarsen_x else lv.ax,
+                             lv.ay / 4 if lv.coarsen_y else lv.ay))
+    return levels
+
+
+class MultigridSolver(object):
+    """
+    Solve the 5-point Laplacian E E^T on (M-1)x(N-1) quadruples, for single frames or stacks.
+    """
+
+    def __init__(self, M, N, tol=1e-10, max_iter=200, n_smooth=2):
+        self.M = M
+        self.N = N
+        self.tol = tol
+        self.max_iter = max_iter
+        self.n_smooth = n_smooth
+        self.levels = _build_levels(M - 1, N - 1)
+        coarsest = self.levels[-1]
+        eye = np.eye(coarsest.m * coarsest.n).reshape(-1, coarsest.m, coarsest.n)
+        dense = _laplacian(eye, coarsest.ax, coarsest.ay).reshape(coarsest.m * coarsest.n, -1)
+        self._coarse_inv = np.linalg.inv(dense)
+        _logger.info("Multigrid for M=%d N=%d with %d levels, coarsest %dx%d" % (
+            M, N, len(self.levels), coarsest.m, coarsest.n))
+
+    def _smooth(self, x, rhs, lv):
+        d = 2 * (lv.ax + lv.ay)
+        for _ in range(self.n_smooth):
+            x += _OMEGA / d * (rhs - _laplacian(x, lv.ax, lv.ay))
+        return x
+
+    def _vcycle(self, rhs, k=0):
+        lv = self.levels[k]
+        if k == len(self.levels) - 1:
+            flat = rhs.reshape(rhs.shape[:-2] + (-1,))
+            return (flat @ self._coarse_inv.T).reshape(rhs.shape)
+        x = self._smooth(np.zeros(rhs.shape), rhs, lv)
+        r = rhs - _laplacian(x, lv.ax, lv.ay)
+        if lv.coarsen_x:
+            r = _restrict(r, -2)
+        if lv.coarsen_y:
+            r = _restrict(r, -1)
+        e = self._vcycle(r, k + 1)
+        if lv.coarsen_y:
+            e = _prolong(e, -1, lv.n)
+        if lv.coarsen_x:
+            e = _prolong(e, -2, lv.m)
+        x += e
+        return self._smooth(x, rhs, lv)
+
+    def solve(self, rhs):
+        """preconditioned conjugate gradient, converged frames stop moving"""
+        lv = self.levels[0]
+        axes = (-2, -1)
+        x = np.zeros(rhs.shape)
+        r = rhs.astype(np.float64)
+        z = self._vcycle(r)
+        p = z.copy()
+        rz = np.sum(r * z, axis=axes, keepdims=True)
+        stop = self.tol * np.sqrt(np.sum(r * r, axis=axes, keepdims=True))
+        for it in range(self.max_iter):
+            res = np.sqrt(np.sum(r * r, axis=axes, keepdims=True))
+            active = res > stop
+            if not np.any(active):
+                _logger.debug("Multigrid cg converged in %d iterations" % it)
+                break
+            Ap = _laplacian(p, lv.ax, lv.ay)
+            pAp = np.sum(p * Ap, axis=axes, keepdims=True)
+            alpha = np.where(active, rz / np.where(pAp > 0, pAp, 1), 0)
+            x += alpha * p
+            r -= alpha * Ap
+            z = self._vcycle(r)
+            rz_new = np.sum(r * z, axis=axes, keepdims=True)
+            beta = np.where(active, rz_new / np.where(rz != 0, rz, 1), 0)
+            p = z + beta * p
+            rz = rz_new
+        else:
+            _logger.warning("Multigrid cg did not converge in %d iterations" % self.max_iter)
+        return x
+
+
+@lru_cache(maxsize=4)
+def get_solver(M, N):
+    """the multigrid hierarchy for MxN frames, built once per process"""
+    return MultigridSolver(M, N)
+
+
+def solve_compatibility_mf(gX, gY):
+    """
+    Matrix-free equivalent of reconstruct.solve_compatibility, for an (M, N) frame or an (F, M, N) stack.
+    No coefficient matrix is built or stored.
+    """
+    M, N = gX.shape[-2:]
+    bX = 2 * np.asarray(gX, dtype=np.float64)
+    bY = 2 * np.asarray(gY, dtype=np.float64)
+    lam = get_solver(M, N).solve(apply_E(bX, bY))
+    u, v = apply_Et(lam)
+    return (bX - u).astype(np.float32), (bY - v).astype(np.float32)
@@ -0,0 +1,163 @@
+# Pick a strategy to solve the compatibility system from a memory and time model
+from __future__ import print_function, absolute_import
+import os
+import logging
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+STRATEGIES = ("lu", "reduced", "iterative", "multigrid")
+
+# Empirical constants, fitted with scipy's splu/cg on 100x50 ... 600x100 frames.
+# factor fill: nnz(L + U) ~ FILL * n * log2(n)
+_LU_FILL = 3.0
+_REDUCED_FILL = 3.5
+# seconds per n^1.5, for factorization (lu, reduced) or one cg solve (iterative)
+_LU_TIME = 20e-9
+_REDUCED_TIME = 35e-9
+_CG_TIME = 45e-9
+# seconds per pixel for one multigrid preconditioned cg solve
+_MG_TIME = 2e-6
+# seconds per factor nonzero for one forward/backward substitution
+_SUBS_TIME = 4e-9
+# superlu keeps working arrays on top of the factor itself
+_FACTOR_OVERHEAD = 1.5
+_INDEX_BYTES = 4
+
+
+class SolvePlan(object):
+    """
+    The chosen strategy for an MxN frame, with the estimates of every candidate:
+    estimates[strategy] = {"fill": factor nonzeros, "memory": peak bytes of one solver,
+                           "shared": bytes export_factor writes, "worker": bytes of a worker attached to them,
+                           "total": bytes for the whole run, "time": seconds for n_frames}
+    memory_budget: bytes available to the whole run
+    """
+
+    def __init__(self, M, N, dtype, strategy, estimates, memory_budget, forced=False):
+        self.M = M
+        self.N = N
+        self.dtype = dtype
+        self.strategy = strategy
+        self.estimates = estimates
+        self.memory_budget = memory_budget
+        self.forced = forced
+
+    def __repr__(self):
+        est = self.estimates[self.strategy]
+        return "SolvePlan(M=%d, N=%d, dtype=%s, strategy=%s%s, memory=%.1f MB of %.1f MB, time=%.2f s)" % (
+            self.M, self.N, np.dtype(self.dtype).name, self.strategy, " (forced)" if self.forced else "",
+            est["total"] / 2 ** 20, self.memory_budget / 2 ** 20, est["time"])
+
+
+def available_memory():
+    """
+    memory available to new allocations in bytes (MemAvailable, which counts reclaimable page cache),
+    None if it cannot be determined
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate(M, N, dtype=np.float64, n_frames=1, n_parallel=1):
+    """
+    estimate factor fill, peak memory (per worker) and wall time of every strategy for n_frames MxN frames,
+    solved by n_parallel workers running at the same time, each with its own setup,
+    and the memory of the factor when it is exported once and shared by the workers instead (monet.shared)
+    """
+    n_frames = int(np.ceil(n_frames / max(1, n_parallel)))
+    item = np.dtype(dtype).itemsize + _INDEX_BYTES
+    n_px = 2 * M * N
+    n_eq = (M - 1) * (N - 1)
+    nnz_E = 4 * n_eq
+    vectors = 8 * (n_px + n_eq) * np.dtype(np.float64).itemsize
+
+    estimates = {}
+    n = n_px + n_eq
+    fill = _LU_FILL * n * np.log2(n)
+    estimates["lu"] = {
+        "fill": int(fill),
+        "memory": int((fill * _FACTOR_OVERHEAD + n_px + 2 * nnz_E) * item + vectors),
+        "shared": int(fill * item),
+        "worker": vectors,
+        "time": _LU_TIME * n ** 1.5 + n_frames * _SUBS_TIME * fill,
+    }
+    n = n_eq
+    fill = _REDUCED_FILL * n * np.log2(n)
+    estimates["reduced"] = {
+        "fill": int(fill),
+        "memory": int((fill * _FACTOR_OVERHEAD + 9 * n_eq + nnz_E) * item + vectors),
+        "shared": int((fill + nnz_E) * item),
+        "worker": vectors,
+        "time": _REDUCED_TIME * n ** 1.5 + n_frames * _SUBS_TIME * fill,
+    }
+    estimates["iterative"] = {
+        "fill": 0,
+        "memory": int((9 * n_eq + nnz_E) * item + vectors),
+        "shared": int((9 * n_eq + nnz_E) * item),
+        "worker": vectors,
+        "time": n_frames * _CG_TIME * n ** 1.5,
+    }
+    # matrix-free: cg vectors plus v-cycle work arrays (4/3 of the finest level), about 15 multiplier arrays
+    estimates["multigrid"] = {
+        "fill": 0,
+        "memory": int(15 * n_eq * np.dtype(np.float64).itemsize + vectors),
+        "shared": 0,
+        "worker": int(15 * n_eq * np.dtype(np.float64).itemsize + vectors),
+        "time": n_frames * _MG_TIME * M * N,
+    }
+    return estimates
+
+
+def plan_solve(M, N, dtype=np.float64, strategy=None, n_frames=1, n_workers=1, n_cores=None, memory=None,
+               memory_fraction=0.7, shared_factor=False):
+    """
+    Plan how to solve compatibility for MxN frames.
+    strategy: force one of STRATEGIES, defaults to the MONET_SOLVER environment variable, or automatic
+    n_frames: number of frames in the run, amortizes factorization
+    n_workers: number of workers sharing the memory and the frames
+    n_cores: cores available, detected if None; at most this many workers run at the same time
+    memory: available bytes, detected if None
+    shared_factor: the factor is exported once and attached by the workers (monet.shared), so it counts once
+    Plan once per run and pass the plan around, so every frame uses the same strategy.
+    """
+    if n_cores is None:
+        n_cores = os.cpu_count() or 1
+    n_workers = max(1, n_workers)
+    if n_workers > n_cores:
+        _logger.warning("%d workers on %d cores, only %d run at the same time" % (n_workers, n_cores, n_cores))
+    estimates = estimate(M, N, dtype=dtype, n_frames=n_frames, n_parallel=min(n_workers, n_cores))
+    for est in estimates.values():
+        if shared_factor:
+            # the parent factorizes once before the workers attach
+            est["total"] = max(est["memory"], est["shared"] + n_workers * est["worker"])
+        else:
+            est["total"] = n_workers * est["memory"]
+    if memory is None:
+        memory = available_memory()
+    budget = memory_fraction * memory if memory is not None else float("inf")
+
+    if strategy is None:
+        strategy = os.environ.get("MONET_SOLVER") or None
+    if strategy is not None:
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown solver strategy %s, expecting one of %s" % (strategy, STRATEGIES))
+        return SolvePlan(M, N, dtype, strategy, estimates, budget, forced=True)
+
+    fits = [s for s in STRATEGIES if estimates[s]["total"] <= budget]
+    if len(fits) == 0:
+        strategy = min(STRATEGIES, key=lambda s: estimates[s]["total"])
+        _logger.warning("No strategy fits in %.1f MB for M=%d N=%d, falling back to %s" % (
+            budget / 2 ** 20, M, N, strategy))
+    else:
+        strategy = min(fits, key=lambda s: estimates[s]["time"])
+    return SolvePlan(M, N, dtype, strategy, estimates, budget)
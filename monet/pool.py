@@ -0,0 +1,41 @@
+from __future__ import print_function, absolute_import
+import os
+import logging
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+def get_pool(n_jobs=-1, plan=None, factor_dir=None):
+    """
+    Get a persistent process pool whose workers stay alive between jobs.
+    Each worker initializes logging, loads the compiled integration kernel and warms up the solver once,
+    then keeps it across frames.
+    plan: a monet.planner.SolvePlan, its solver is set up when a worker starts
+    factor_dir: a factor exported by monet.shared.export_factor, attached when a worker starts (overrides plan)
+    Calling it again with the same arguments returns the same pool.
+    """
+    from joblib.externals.loky import get_reusable_executor
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    return get_reusable_executor(max_workers=n_jobs, initializer=_init_worker, initargs=(plan, factor_dir),
+                                 reuse=True)
+
+
+def _init_worker(plan, factor_dir):
+    from monet import init_logging
+    from monet.reconstruct import integrate, solve_compatibility
+    init_logging()
+    # numba loads (or compiles) a kernel on its first call for each argument type, not on import
+    for dtype in (np.float32, np.float64):
+        g = np.zeros((2, 2), dtype=dtype)
+        integrate(g, g)
+    if factor_dir is not None:
+        from monet.shared import attach_factor
+        factor = attach_factor(factor_dir)
+        g = np.zeros((factor.M, factor.N))
+        solve_compatibility(g, g, factor=factor)
+    elif plan is not None:
+        g = np.zeros((plan.M, plan.N))
+        solve_compatibility(g, g, plan=plan)
+    _logger.info("Worker %d is ready" % os.getpid())
@@ -2,9 +2,8 @@ from __future__ import print_function, absolute_import
 import os
 import logging
 import numpy as np
-import scipy.sparse.linalg as sla
 
-from scipy import sparse
+from functools import lru_cache
 
 _logger = logging.getLogger(__name__)
 
@@ -15,49 +14,186 @@ def build_b(gX, gY):
     """
     M, N = gX.shape
     padding = np.zeros((M - 1) * (N - 1))
-    vec_b = np.transpose(np.hstack([2 * gX.flatten(), 2 * gY.flatten(), padding]).astype(np.float))
+    vec_b = np.transpose(np.hstack([2 * gX.flatten(), 2 * gY.flatten(), padding]).astype(np.float64))
     return vec_b
 
 
-def solve_compatibility(gX, gY):
-    M, N = gX.shape
-    vec_b = build_b(gX, gY)
+@lru_cache(maxsize=4)
+def load_solver(M, N, dtype=np.float64):
+    """
+    Load the coefficient matrix for MxN pixels and factorize it.
+    The factor is cached, so a long-lived worker only pays for it once per frame size.
+    """
+    import scipy.sparse.linalg as sla
+    from scipy import sparse
 
     prj_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     npz_file = os.path.join(prj_root, "data", "A_%d_%d.npz" % (M, N))
-    if not os.path.exists(npz_file):
-        raise Exception("No the coefficient matrix for M=%d N=%d, please run coef.py to generate it." % (M, N))
-    mat_A = sparse.load_npz(npz_file).astype(np.float)
+    if os.path.exists(npz_file):
+        mat_A = sparse.load_npz(npz_file).astype(dtype)
+    else:
+        from monet.coef import assemble_E
+        _logger.info("No coefficient matrix file for M=%d N=%d, assembling it in memory" % (M, N))
+        mat_E = assemble_E(M, N, dtype=dtype)
+        mat_A = sparse.bmat([[sparse.identity(2 * M * N, dtype=dtype), mat_E.transpose()], [mat_E, None]]).tocsc()
+
+    _logger.info("Factorizing coefficient matrix for M=%d N=%d ..." % (M, N))
+    return sla.splu(mat_A)
+
+
+@lru_cache(maxsize=4)
+def load_reduced_solver(M, N, dtype=np.float64, factorize=True):
+    """
+    Eliminate the pixels from the KKT system, which leaves the symmetric positive definite
+    E E^T on the (M-1)x(N-1) multipliers. Returns E, E E^T and its factor (None if not factorize).
+    """
+    import scipy.sparse.linalg as sla
+    from monet.coef import assemble_E
+
+    mat_E = assemble_E(M, N, dtype=dtype)
+    mat_R = (mat_E @ mat_E.transpose()).tocsc()
+    factor = None
+    if factorize:
+        _logger.info("Factorizing reduced matrix for M=%d N=%d ..." % (M, N))
+        factor = sla.splu(mat_R, permc_spec="MMD_AT_PLUS_A")
+    return mat_E, mat_R, factor
+
 
-    _logger.info("Start solving linear system ...")
-    solver = sla.splu(mat_A)
-    sol = solver.solve(vec_b)
+def solve_cg(mat_R, rhs, tol=1e-10):
+    """conjugate gradient on the reduced system E E^T"""
+    import scipy.sparse.linalg as sla
+    try:
+        lam, info = sla.cg(mat_R, rhs, rtol=tol)
+    except TypeError:
+        # scipy < 1.12
+        lam, info = sla.cg(mat_R, rhs, tol=tol)
+    if info > 0:
+        _logger.warning("cg did not converge in %d iterations for a system of size %d" % (info, rhs.size))
+    return lam
+
+
+def _solve_reduced(M, N, vec_b, dtype, iterative=False, tol=1e-10):
+    """
+    Q = I, so x = b - E^T l where E E^T l = E b
+    """
+    mat_E, mat_R, factor = load_reduced_solver(M, N, dtype=dtype, factorize=not iterative)
+    rhs = mat_E @ vec_b
+    if iterative:
+        lam = solve_cg(mat_R, rhs, tol=tol)
+    else:
+        lam = factor.solve(rhs)
+    return vec_b - mat_E.transpose() @ lam
+
+
+def solve_compatibility(gX, gY, strategy=None, dtype=np.float64, plan=None, factor=None):
+    """
+    Project gradients onto compatible fields.
+    strategy: one of monet.planner.STRATEGIES, picked by the planner if None
+    plan: a monet.planner.SolvePlan to reuse, overrides strategy and dtype
+    factor: a monet.shared.SharedFactor shared by all workers, overrides plan
+    """
+    M, N = gX.shape
+    if factor is not None:
+        if (factor.M, factor.N) != (M, N):
+            raise ValueError("Shared factor is for M=%d N=%d, got a frame of M=%d N=%d" % (factor.M, factor.N, M, N))
+        _logger.info("Start solving linear system with shared %s factor ..." % factor.strategy)
+        sol = factor.solve(2 * np.hstack([gX.ravel(), gY.ravel()]).astype(np.float64))
+        sX = sol[: M * N].reshape(M, N).astype(np.float32)
+        sY = sol[M * N: 2 * M * N].reshape(M, N).astype(np.float32)
+        return sX, sY
+
+    if plan is None:
+        from monet.planner import plan_solve
+        plan = plan_solve(M, N, dtype=dtype, strategy=strategy)
+    dtype = plan.dtype
+
+    _logger.info("Start solving linear system with %s ..." % plan)
+    if plan.strategy == "multigrid":
+        from monet.multigrid import solve_compatibility_mf
+        return solve_compatibility_mf(gX, gY)
+    if plan.strategy == "lu":
+        vec_b = build_b(gX, gY).astype(dtype)
+        sol = load_solver(M, N, dtype=dtype).solve(vec_b)
+    else:
+        vec_b = (2 * np.hstack([gX.ravel(), gY.ravel()])).astype(dtype)
+        sol = _solve_reduced(M, N, vec_b, dtype, iterative=plan.strategy == "iterative")
 
     sX = sol[: M * N].reshape(M, N).astype(np.float32)
     sY = sol[M * N: 2 * M * N].reshape(M, N).astype(np.float32)
     return sX, sY
 
 
+INTEGRATION_PATHS = ("row", "col", "row_last", "col_last")
+
+
+def integrate(gX, gY, paths=("row",)):
+    """
+    Integrate gradient fields into z, for a single (M, N) frame or an (F, M, N) stack.
+    Z[0, 0] is always 0, gX is the gradient along axis 0 and gY along axis 1.
+    paths:
+        "row"       walk along the first row, then along each column (same as reconstruct)
+        "col"       walk along the first column, then along each row (same as reconstruct_t)
+        "row_last"  like "row" but pivot on the last row
+        "col_last"  like "col" but pivot on the last column
+    When several paths are given, their results are averaged in the same sweep.
+    """
+    if isinstance(paths, str):
+        paths = (paths,)
+    for p in paths:
+        if p not in INTEGRATION_PATHS:
+            raise ValueError("Unknown integration path %s, expecting one of %s" % (p, INTEGRATION_PATHS))
+    if len(paths) == 0:
+        raise ValueError("At least one integration path is required")
+
+    single = gX.ndim == 2
+    if single:
+        gX, gY = gX[np.newaxis], gY[np.newaxis]
+    if gX.shape != gY.shape:
+        raise ValueError("gX and gY must have the same shape, got %s and %s" % (gX.shape, gY.shape))
+    _, M, N = gX.shape
+    pivot_rows = np.array([0 if p == "row" else M - 1 for p in paths if p.startswith("row")], dtype=np.int64)
+    pivot_cols = np.array([0 if p == "col" else N - 1 for p in paths if p.startswith("col")], dtype=np.int64)
+
+    from monet.kernels import integrate_stack
+    Z = np.empty(gX.shape, dtype=np.float32)
+    integrate_stack(gX, gY, pivot_rows, pivot_cols, Z)
+    return Z[0] if single else Z
+
+
 def reconstruct(gX, gY):
-    M = gX.shape[0]
-    N = gY.shape[1]
-    # left line
-    z0 = np.hstack([np.zeros(1), gY[0, :].cumsum()])
-    Z0 = np.vstack([z0] * M)[:, :N]
-    # going right
-    A = np.vstack([np.zeros((1, gX.shape[1])), gX.cumsum(axis=0)])[:M, :]
-    return (A + Z0).astype(np.float32)
+    return integrate(gX, gY, paths="row")
 
 
 def reconstruct_t(gX, gY):
     """Reconstruct by a different integration path"""
-    # switch X and Y
-    gX, gY = gY.transpose(), gX.transpose()
-    # normal reconstruct
-    Z = reconstruct(gX, gY)
-    # switch back X and Y
-    return Z.transpose()
+    return integrate(gX, gY, paths="col")
+
+
+def compatibility_residual(gX, gY):
+    """
+    Residual of the compatibility equation at every quadruple:
+    gX_i,j + gY_i+1,j - gX_i,j+1 - gY_i,j
+    Works on a single (M, N) frame or an (F, M, N) stack, returns (..., M-1, N-1).
+    """
+    return gX[..., :-1, :-1] + gY[..., 1:, :-1] - gX[..., :-1, 1:] - gY[..., :-1, :-1]
+
+
+def residual_stats(gX, gY, percentiles=(50, 95, 99)):
+    """
+    Summary statistics of the absolute compatibility residual.
+    Values are scalars for a single frame, or arrays of length F for an (F, M, N) stack.
+    """
+    R = np.abs(compatibility_residual(gX, gY)).astype(np.float64)
+    R = R.reshape(R.shape[:-2] + (-1,))
+    stats = {
+        "rms": np.sqrt(np.mean(R ** 2, axis=-1)),
+        "mean": R.mean(axis=-1),
+        "max": R.max(axis=-1),
+    }
+    for q, v in zip(percentiles, np.percentile(R, percentiles, axis=-1)):
+        stats["p%g" % q] = v
+    return stats
 
 
 def examine(gX, gY, i, j):
-    print(gX[i, j] + gY[i+1, j] - gX[i, j+1] - gY[i, j])
+    print(compatibility_residual(gX, gY)[i, j])
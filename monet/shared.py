@@ -0,0 +1,156 @@
+# Share one factorization of the compatibility system between worker processes.
+# The factor is exported once as .npy files, workers memory-map them read-only,
+# so the operating system keeps a single copy in its page cache whatever the number of workers.
+from __future__ import print_function, absolute_import
+import os
+import json
+import shutil
+import logging
+import tempfile
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+# room left in /dev/shm for everything else using it
+_SHM_MARGIN = 1.2
+
+
+def _shm_dir(nbytes):
+    """
+    /dev/shm if available and with room for nbytes, so the factor lives in memory instead of on disk,
+    None (the system temp dir) otherwise. Containers often mount a small /dev/shm, 64 MB by default with Docker.
+    """
+    if not os.path.isdir("/dev/shm"):
+        return None
+    free = shutil.disk_usage("/dev/shm").free
+    if nbytes * _SHM_MARGIN > free:
+        _logger.warning("%.1f MB factor does not fit in /dev/shm (%.1f MB free), using the temp dir" % (
+            nbytes / 2 ** 20, free / 2 ** 20))
+        return None
+    return "/dev/shm"
+
+
+def _sparse_arrays(name, mat):
+    """the compressed (csc or csr) arrays of mat"""
+    return {"%s_%s" % (name, part): getattr(mat, part) for part in ("data", "indices", "indptr")}
+
+
+def _splu_arrays(factor):
+    arrays = _sparse_arrays("L", factor.L.tocsc())
+    arrays.update(_sparse_arrays("U", factor.U.tocsc()))
+    arrays["perm_r"] = factor.perm_r
+    arrays["perm_c"] = factor.perm_c
+    return arrays
+
+
+def export_factor(M, N, directory=None, strategy=None, dtype=np.float64):
+    """
+    Factorize the compatibility system for MxN frames once and write it to `directory`,
+    a new folder under /dev/shm (or the system temp dir if it does not fit) if None.
+    strategy: as in monet.planner, "iterative" exports the reduced operator instead of a factor,
+    "multigrid" is matrix-free and exports nothing but its metadata
+    The factorization is not kept in this process, workers only use the exported copy.
+    Returns the directory, to pass to attach_factor in the workers, remove it once they are done.
+    """
+    from monet.reconstruct import load_solver, load_reduced_solver
+    if strategy is None:
+        from monet.planner import plan_solve
+        strategy = plan_solve(M, N, dtype=dtype, shared_factor=True).strategy
+
+    arrays = {}
+    if strategy == "lu":
+        arrays.update(_splu_arrays(load_solver(M, N, dtype=dtype)))
+    elif strategy != "multigrid":
+        # multigrid is matrix-free, nothing to share
+        mat_E, mat_R, factor = load_reduced_solver(M, N, dtype=dtype, factorize=strategy == "reduced")
+        arrays.update(_sparse_arrays("E", mat_E.tocsr()))
+        arrays.update(_sparse_arrays("R", mat_R.tocsr()) if factor is None else _splu_arrays(factor))
+        del mat_E, mat_R, factor
+    # the parent only exports, drop its own copy of the factorization
+    load_solver.cache_clear()
+    load_reduced_solver.cache_clear()
+
+    nbytes = sum(a.nbytes for a in arrays.values())
+    created = directory is None
+    if created:
+        directory = tempfile.mkdtemp(prefix="monet_factor_%d_%d_" % (M, N), dir=_shm_dir(nbytes))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for name, a in arrays.items():
+            np.save(os.path.join(directory, name + ".npy"), a)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"M": M, "N": N, "strategy": strategy, "dtype": np.dtype(dtype).name}, f)
+    except Exception:
+        if created:
+            shutil.rmtree(directory, ignore_errors=True)
+        raise
+    _logger.info("Exported %s factor for M=%d N=%d (%.1f MB) to %s" % (strategy, M, N, nbytes / 2 ** 20, directory))
+    return directory
+
+
+class SharedFactor(object):
+    """
+    Read-only view of an exported factor, all arrays are memory-mapped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.M = meta["M"]
+        self.N = meta["N"]
+        self.strategy = meta["strategy"]
+        self.dtype = np.dtype(meta["dtype"])
+        self._arrays = {}
+        for name in os.listdir(directory):
+            if name.endswith(".npy"):
+                self._arrays[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode="r")
+        n_eq = (self.M - 1) * (self.N - 1)
+        self.mat_E = self._csr("E", (n_eq, 2 * self.M * self.N)) if "E_data" in self._arrays else None
+        self.mat_R = self._csr("R", (n_eq, n_eq)) if "R_data" in self._arrays else None
+
+    def _csr(self, name, shape):
+        from scipy import sparse
+        a = self._arrays
+        return sparse.csr_matrix((a[name + "_data"], a[name + "_indices"], a[name + "_indptr"]),
+                                 shape=shape, copy=False)
+
+    def _lu_solve(self, b):
+        from monet.kernels import lu_solve
+        a = self._arrays
+        return lu_solve(a["L_data"], a["L_indices"], a["L_indptr"], a["U_data"], a["U_indices"], a["U_indptr"],
+                        a["perm_r"], a["perm_c"], b.astype(np.float64))
+
+    def solve(self, vec_b):
+        """solve for the 2MN pixel values given b = 2 [gX, gY] (flattened)"""
+        n_eq = (self.M - 1) * (self.N - 1)
+        if self.strategy == "multigrid":
+            from monet.multigrid import get_solver, apply_E, apply_Et
+            M, N = self.M, self.N
+            bX, bY = vec_b[: M * N].reshape(M, N), vec_b[M * N:].reshape(M, N)
+            u, v = apply_Et(get_solver(M, N).solve(apply_E(bX, bY)))
+            return vec_b - np.hstack([u.ravel(), v.ravel()])
+        if self.strategy == "lu":
+            return self._lu_solve(np.hstack([vec_b, np.zeros(n_eq)]))[: vec_b.size]
+        rhs = self.mat_E @ vec_b
+        if self.strategy == "reduced":
+            lam = self._lu_solve(rhs)
+        else:
+            from monet.reconstruct import solve_cg
+            lam = solve_cg(self.mat_R, rhs)
+        return vec_b - self.mat_E.transpose() @ lam
+
+    def nbytes(self):
+        return sum(a.nbytes for a in self._arrays.values())
+
+
+def attach_factor(directory):
+    """
+    Attach to an exported factor. Cheap, the arrays are mapped and not read, so attach per frame and drop it:
+    a factor kept alive in a long-lived worker would hold the /dev/shm memory after the directory is removed.
+    """
+    factor = SharedFactor(directory)
+    _logger.debug("Attached to %s factor for M=%d N=%d (%.1f MB shared) in %s" % (
+        factor.strategy, factor.M, factor.N, factor.nbytes() / 2 ** 20, directory))
+    return factor
@@ -0,0 +1,241 @@
+# Live acquisition: watch a directory of gradient files and reconstruct frames as they arrive
+from __future__ import print_function, absolute_import
+import os
+import re
+import time
+import logging
+import h5py
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+def _pattern_regex(pattern):
+    """turn a printf style file pattern such as gradz%04d.h5 into a regex capturing the frame number"""
+    parts = re.split(r"%0?\d*d", pattern)
+    if len(parts) != 2:
+        raise ValueError("File pattern %s must contain exactly one integer field" % pattern)
+    return re.compile("^%s(\\d+)%s$" % (re.escape(parts[0]), re.escape(parts[1])))
+
+
+def _is_complete(h5_file, datasets):
+    """a file is complete once HDF5 can open it and all data sets can be read"""
+    try:
+        with h5py.File(h5_file, 'r') as f:
+            for ds in datasets:
+                if ds not in f:
+                    return False
+                f[ds][()]
+        return True
+    except (OSError, KeyError, RuntimeError):
+        return False
+
+
+class FrameWatcher(object):
+    """
+    Watch grad_dir for gradient files, and reconstruct each frame once it is completely written.
+    Outputs per frame, in out_dir:
+        z/z_%03d.h5             solved gradients and z field
+        z_flat/z_flat_%03d.h5   flattened by the background gradient, if a background is set
+        xdmf/xdmf_%03d.xmf|h5   ParaView files, collected in xdmf/frames.xmf
+    background: (gX_bg, gY_bg) to remove, or an int frame whose mean gradients are used once it is solved;
+        frames solved before it are then flattened and exported again
+    settle: seconds the file size must stay unchanged before it is read
+    precision, storage: reduced precision storage of z/gx/gy, see monet.io.write_field;
+        the gradients of z/ are kept exact when they are flattened
+    """
+
+    def __init__(self, grad_dir, out_dir, pattern="gradz%04d.h5", gx_ds="gradz_x", gy_ds="gradz_y",
+                 background=None, strategy=None, xdmf=True, settle=0.05, length_scale=1, precision=None,
+                 storage="scaleoffset"):
+        self.grad_dir = grad_dir
+        self.out_dir = out_dir
+        self.regex = _pattern_regex(pattern)
+        self.gx_ds = gx_ds
+        self.gy_ds = gy_ds
+        self.background = background
+        self.strategy = strategy
+        self.xdmf = xdmf
+        self.settle = settle
+        self.length_scale = length_scale
+        self.precision = precision
+        self.storage = storage
+
+        self.z_dir = os.path.join(out_dir, "z")
+        self.z_flat_dir = os.path.join(out_dir, "z_flat")
+        self.xdmf_dir = os.path.join(out_dir, "xdmf")
+        for d in (self.z_dir, self.z_flat_dir, self.xdmf_dir):
+            os.makedirs(d, exist_ok=True)
+
+        self.plan = None
+        self.done = set()
+        self.failed = {}
+        self.latencies = {}
+        self._sizes = {}
+        self._xdmf_frames = {}
+
+    def warmup(self, M, N):
+        """plan, factorize and load the compiled kernels for MxN frames before the acquisition starts"""
+        from monet.planner import plan_solve
+        from monet.reconstruct import solve_compatibility, reconstruct
+        self.plan = plan_solve(M, N, strategy=self.strategy)
+        _logger.info("Live reconstruction with %s" % self.plan)
+        gX, gY = solve_compatibility(np.zeros((M, N)), np.zeros((M, N)), plan=self.plan)
+        reconstruct(gX, gY)
+
+    def pending(self):
+        """frames whose file has been written completely and not processed yet, in order"""
+        ready = []
+        now = time.time()
+        for entry in os.scandir(self.grad_dir):
+            m = self.regex.match(entry.name)
+            if m is None:
+                continue
+            frm = int(m.group(1))
+            if frm in self.done:
+                continue
+            st = entry.stat()
+            last = self._sizes.get(frm)
+            self._sizes[frm] = st.st_size
+            if last != st.st_size or now - st.st_mtime < self.settle:
+                continue
+            datasets = [self.gx_ds] if self.gy_ds is None else [self.gx_ds, self.gy_ds]
+            if _is_complete(entry.path, datasets):
+                ready.append((frm, entry.path, st.st_mtime))
+        return sorted(ready)
+
+    def process(self, frm, grad_h5, captured=None):
+        """reconstruct (and flatten) one frame, return the latency since capture (or since the call)"""
+        from monet.io import read_h5
+        from monet.reconstruct import solve_compatibility, reconstruct
+
+        t0 = time.time()
+        gX, gY = read_h5(grad_h5, gx_ds=self.gx_ds, gy_ds=self.gy_ds)
+        if self.plan is None:
+            from monet.planner import plan_solve
+            self.plan = plan_solve(gX.shape[0], gX.shape[1], strategy=self.strategy)
+            _logger.info("Live reconstruction with %s" % self.plan)
+        gX, gY = solve_compatibility(gX, gY, plan=self.plan)
+        z_h5 = os.path.join(self.z_dir, "z_%03d.h5" % frm)
+        # gradients to flatten (now or once the background frame arrives) are kept exact
+        self._write_z(z_h5, reconstruct(gX, gY), gX, gY, exact_gradients=self.background is not None)
+
+        if isinstance(self.background, int) and self.background == frm:
+            self.background = (gX.mean(), gY.mean())
+            _logger.info("Using frame %d as background" % frm)
+            self._reflatten(sorted(self.done.difference(self.failed)))
+        if self.background is not None and not isinstance(self.background, int):
+            self._export(frm, self._flatten(frm, gX, gY))
+        else:
+            self._export(frm, z_h5)
+
+        self.done.add(frm)
+        t1 = time.time()
+        latency = t1 - (captured if captured is not None else t0)
+        self.latencies[frm] = latency
+        _logger.info("Live frame %d done in %.3f sec, %.3f sec after capture" % (frm, t1 - t0, latency))
+        return latency
+
+    def _flatten(self, frm, gX, gY):
+        """remove the background gradients and reconstruct, return the z_flat file"""
+        from monet.reconstruct import reconstruct
+        gX_bg, gY_bg = self.background
+        gX, gY = gX - gX_bg, gY - gY_bg
+        z_flat_h5 = os.path.join(self.z_flat_dir, "z_flat_%03d.h5" % frm)
+        self._write_z(z_flat_h5, reconstruct(gX, gY), gX, gY)
+        return z_flat_h5
+
+    def _reflatten(self, frames):
+        """flatten and export again the frames solved before the background was known"""
+        from monet.io import read_h5
+        for frm in frames:
+            try:
+                gX, gY = read_h5(os.path.join(self.z_dir, "z_%03d.h5" % frm), gx_ds="gx", gy_ds="gy")
+                self._export(frm, self._flatten(frm, gX, gY))
+                _logger.info("Flattened earlier frame %d" % frm)
+            except Exception as e:
+                _logger.exception("Flattening earlier frame %d failed" % frm)
+                self.failed[frm] = e
+
+    def _export(self, frm, z_h5):
+        """convert to XDMF and update the temporal collection, replacing the frame if already exported"""
+        if not self.xdmf:
+            return
+        from monet.xdmf import z_file_to_xdmf, write_temporal_collection
+        xdmf_file, _ = z_file_to_xdmf(z_h5, self.xdmf_dir, "xdmf_%03d" % frm,
+                                      length_scale=self.length_scale, precision=self.precision)
+        self._xdmf_frames[frm] = xdmf_file
+        times = sorted(self._xdmf_frames)
+        write_temporal_collection(self.xdmf_dir, "frames", [self._xdmf_frames[t] for t in times], times=times)
+
+    def _write_z(self, z_h5, Z, gX, gY, exact_gradients=False):
+        from monet.io import write_field
+        precision = None if exact_gradients else self.precision
+        tmp_file = z_h5 + ".tmp"
+        with h5py.File(tmp_file, 'w') as h5:
+            write_field(h5, "z", Z, precision=self.precision, mode=self.storage)
+            write_field(h5, "gx", gX, precision=precision, mode=self.storage)
+            write_field(h5, "gy", gY, precision=precision, mode=self.storage)
+        os.replace(tmp_file, z_h5)
+
+    def run(self, poll=0.05, idle_timeout=None, max_frames=None):
+        """
+        Process frames as they arrive until idle for idle_timeout seconds, max_frames are done, or interrupted.
+        A frame that fails is logged, recorded in self.failed and not retried.
+        Returns the latency of every frame processed.
+        """
+        last_frame_time = time.time()
+        try:
+            while max_frames is None or len(self.done) < max_frames:
+                ready = self.pending()
+                for frm, grad_h5, captured in ready:
+                    try:
+                        self.process(frm, grad_h5, captured)
+                    except Exception as e:
+                        _logger.exception("Live frame %d failed, skipping it" % frm)
+                        self.failed[frm] = e
+                        self.done.add(frm)
+                        if self.background == frm:
+                            _logger.warning("Background frame %d failed, frames are not flattened" % frm)
+                    last_frame_time = time.time()
+                if not ready:
+                    if idle_timeout is not None and time.time() - last_frame_time > idle_timeout:
+                        _logger.info("No new frame for %.1f sec, stop watching" % idle_timeout)
+                        break
+                    time.sleep(poll)
+        except KeyboardInterrupt:
+            _logger.info("Stop watching %s" % self.grad_dir)
+        if self.latencies:
+            lat = np.array(list(self.latencies.values()))
+            _logger.info("Processed %d frames, latency mean %.3f sec, max %.3f sec" % (lat.size, lat.mean(), lat.max()))
+        if self.failed:
+            _logger.warning("%d frames failed: %s" % (len(self.failed), sorted(self.failed)))
+        return self.latencies
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    prj_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, prj_root)
+
+    from monet import init_logging
+    init_logging()
+
+    parser = argparse.ArgumentParser(description="Reconstruct gradient files as they are written")
+    parser.add_argument("grad_dir")
+    parser.add_argument("out_dir")
+    parser.add_argument("--pattern", default="gradz%04d.h5")
+    parser.add_argument("--background", type=int, default=None, help="frame to use as background for flattening")
+    parser.add_argument("--strategy", default=None, help="solver strategy, see monet.planner")
+    parser.add_argument("--shape", type=int, nargs=2, default=None, metavar=("M", "N"),
+                        help="frame size, to warm up the solver before the first frame")
+    parser.add_argument("--precision", type=float, default=None, help="absolute precision kept in the outputs")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="stop after so many seconds without frames")
+    args = parser.parse_args()
+
+    watcher = FrameWatcher(args.grad_dir, args.out_dir, pattern=args.pattern, background=args.background,
+                           strategy=args.strategy, precision=args.precision)
+    if args.shape is not None:
+        watcher.warmup(*args.shape)
+    watcher.run(idle_timeout=args.idle_timeout)
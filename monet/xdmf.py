@@ -3,16 +3,22 @@ import h5py
 
 import numpy as np
 
+from monet.io import read_field, write_field
 
-def z_file_to_xdmf(z_file, xdmf_dir, filename, length_scale=1):
+
+def z_file_to_xdmf(z_file, xdmf_dir, filename, length_scale=1, precision=None):
+    """
+    precision: absolute precision kept for Z, GX and GY (HDF5 scale-offset filter, readable by ParaView),
+    full float32 if None. Coordinates are then stored lossless but compressed.
+    """
     xdmf_file = os.path.join(xdmf_dir, "%s.xmf" % filename)
     h5_file_name = "%s.h5" % filename
     h5_file = os.path.join(xdmf_dir, h5_file_name)
 
     with h5py.File(z_file, "r") as fh5:
-        z_data = np.array(fh5["z"])
-        gx_data = np.array(fh5["gx"])
-        gy_data = np.array(fh5["gy"])
+        z_data = read_field(fh5, "z")
+        gx_data = read_field(fh5, "gx")
+        gy_data = read_field(fh5, "gy")
 
     # Dimensions
     nx, ny = z_data.shape[0], z_data.shape[1]
@@ -35,11 +41,15 @@ def z_file_to_xdmf(z_file, xdmf_dir, filename, length_scale=1):
     gy[:, :] = gy_data
 
     with h5py.File(h5_file, 'w') as h5:
-        h5.create_dataset("X", data=x)
-        h5.create_dataset("Y", data=y)
-        h5.create_dataset("Z", data=z)
-        h5.create_dataset("GX", data=gx)
-        h5.create_dataset("GY", data=gy)
+        if precision is None:
+            h5.create_dataset("X", data=x)
+            h5.create_dataset("Y", data=y)
+        else:
+            h5.create_dataset("X", data=x, shuffle=True, compression="gzip")
+            h5.create_dataset("Y", data=y, shuffle=True, compression="gzip")
+        write_field(h5, "Z", z, precision=precision)
+        write_field(h5, "GX", gx, precision=precision)
+        write_field(h5, "GY", gy, precision=precision)
 
     with open(xdmf_file, "w") as fout:
         shape = " ".join(map(str, z.shape))
@@ -80,4 +90,33 @@ def z_file_to_xdmf(z_file, xdmf_dir, filename, length_scale=1):
 </Xdmf>
             """ % (shape, shape, h5_file_name, shape, h5_file_name, shape, h5_file_name,
                    shape, h5_file_name, shape, h5_file_name, shape, h5_file_name))
-    return xdmf_file, h5_file
\ No newline at end of file
+    return xdmf_file, h5_file
+
+
+def write_temporal_collection(xdmf_dir, filename, frame_files, times=None):
+    """
+    Write a temporal collection including per-frame xdmf files (as written by z_file_to_xdmf),
+    so a growing sequence can be opened as one time series. Re-write it when frames are appended.
+    """
+    xdmf_file = os.path.join(xdmf_dir, "%s.xmf" % filename)
+    if times is None:
+        times = range(len(frame_files))
+    grids = "\n".join("""     <Grid>
+       <Time Value="%s"/>
+       <xi:include href="%s" xpointer="xpointer(//Xdmf/Domain/Grid/*)"/>
+     </Grid>""" % (t, os.path.relpath(f, xdmf_dir)) for t, f in zip(times, frame_files))
+    tmp_file = xdmf_file + ".tmp"
+    with open(tmp_file, "w") as fout:
+        fout.write("""<?xml version="1.0" ?>
+<!DOCTYPE Xdmf SYSTEM "Xdmf.dtd" []>
+<Xdmf Version="2.0" xmlns:xi="http://www.w3.org/2001/XInclude">
+ <Domain>
+   <Grid Name="frames" GridType="Collection" CollectionType="Temporal">
+%s
+   </Grid>
+ </Domain>
+</Xdmf>
+""" % grids)
+    # readers never see a half written collection
+    os.replace(tmp_file, xdmf_file)
+    return xdmf_file
@@ -0,0 +1,63 @@
+import os
+import sys
+import h5py
+import numpy as np
+
+from scipy.signal import savgol_filter, find_peaks
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.cache import AnalysisCache, prefetch_center_lines
+
+
+def _write(h5_file, G):
+    with h5py.File(h5_file, "w") as f:
+        f.create_dataset("gx", data=G)
+
+
+def test_products_match_inline(tmp_path):
+    rng = np.random.RandomState(0)
+    G = np.cumsum(rng.randn(300, 80), axis=0) * 1e-3
+    h5_file = str(tmp_path / "cl.h5")
+    _write(h5_file, G)
+    G = G * 2.
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    prefetch_center_lines(cache, [h5_file], scale=2., height=0.001, distance=20, mean="in_memory", n_jobs=1)
+    n_products = len(os.listdir(str(tmp_path / "cache")))
+    for _ in range(2):
+        G_hat = cache.smoothed_center_line(h5_file, scale=2.)
+        assert isinstance(G_hat, np.memmap)
+        table = cache.center_line_peaks(h5_file, scale=2., height=0.001, distance=20, mean="in_memory")
+        peaks_at = np.split(table["pos"], np.searchsorted(table["t"], np.arange(1, G.shape[1])))
+        for t in range(G.shape[1]):
+            Yhat = savgol_filter(G[:, t], 51, 3)
+            peaks, _ = find_peaks(Yhat - G.mean(), height=0.001, distance=20)
+            assert np.array_equal(G_hat[:, t], Yhat)
+            assert np.array_equal(peaks_at[t], peaks)
+    # the prefetch computed exactly what was read afterwards
+    assert len(os.listdir(str(tmp_path / "cache"))) == n_products == 2
+
+
+def test_rewritten_source_is_recomputed(tmp_path):
+    h5_file = str(tmp_path / "cl.h5")
+    _write(h5_file, np.zeros((100, 10)))
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    assert np.all(cache.smoothed_center_line(h5_file) == 0)
+    _write(h5_file, np.ones((100, 10)))
+    st = os.stat(h5_file)
+    os.utime(h5_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert np.allclose(cache.smoothed_center_line(h5_file), 1)
+
+
+def test_trajectory_is_cached(tmp_path):
+    h5_file = str(tmp_path / "cl.h5")
+    _write(h5_file, np.zeros((100, 10)))
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    calls = []
+
+    def track():
+        calls.append(1)
+        return {"Y1": np.arange(6.).reshape(2, 3)}
+    for _ in range(2):
+        assert np.array_equal(cache.trajectory(h5_file, {"th": 10}, track)["Y1"], np.arange(6.).reshape(2, 3))
+    assert len(calls) == 1
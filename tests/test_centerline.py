@@ -0,0 +1,63 @@
+import os
+import sys
+import h5py
+import numpy as np
+import pytest
+
+from scipy.signal import savgol_filter, find_peaks
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.centerline import iter_smoothed, iter_peaks, center_line_stats
+
+
+@pytest.fixture
+def center_line(tmp_path):
+    rng = np.random.RandomState(0)
+    G = np.cumsum(rng.randn(300, 260), axis=0) * 1e-3
+    h5_file = str(tmp_path / "cl.h5")
+    with h5py.File(h5_file, "w") as f:
+        f.create_dataset("gx", data=G)
+    return h5_file, G
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 100, 256, 300])
+def test_smooth_time_matches_in_memory(center_line, chunk_size):
+    h5_file, G = center_line
+    expected = savgol_filter(G * 2., 51, 3, axis=1)
+    chunks = [s for _, _, s in iter_smoothed(h5_file, axis="time", chunk_size=chunk_size, scale=2.)]
+    assert np.array_equal(np.concatenate(chunks, axis=1), expected)
+
+
+def test_smooth_time_range(center_line):
+    h5_file, G = center_line
+    expected = savgol_filter(G, 51, 3, axis=1)[:, 240:260]
+    chunks = [s for _, _, s in iter_smoothed(h5_file, axis="time", chunk_size=7, t_range=(240, 260))]
+    assert np.array_equal(np.concatenate(chunks, axis=1), expected)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_peaks_match_in_memory(tmp_path, dtype):
+    G = (np.cumsum(np.random.RandomState(0).randn(300, 260), axis=0) * 1e-3).astype(dtype)
+    h5_file = str(tmp_path / "cl.h5")
+    with h5py.File(h5_file, "w") as f:
+        f.create_dataset("gx", data=G)
+    G = G * 2.
+    mean = G.mean()
+    for t, Yhat, peaks in iter_peaks(h5_file, height=0.001, distance=20, mean=mean, chunk_size=64, scale=2.):
+        Y = savgol_filter(G[:, t], 51, 3)
+        expected, _ = find_peaks(Y - mean, height=0.001, distance=20)
+        assert Yhat.dtype == Y.dtype
+        assert np.array_equal(Yhat, Y)
+        assert np.array_equal(peaks, expected)
+
+
+def test_stats(center_line):
+    h5_file, G = center_line
+    # offset so that E[x^2] - mean^2 cancels catastrophically
+    with h5py.File(h5_file, "a") as f:
+        f["gx"][...] = G + 1e4
+    stats = center_line_stats(h5_file, chunk_size=7)
+    assert np.isclose(stats["mean"], (G + 1e4).mean(), rtol=1e-15)
+    assert np.isclose(stats["std"], G.std(), rtol=1e-9)
+    assert stats["min"] == (G + 1e4).min() and stats["max"] == (G + 1e4).max()
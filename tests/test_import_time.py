@@ -0,0 +1,26 @@
+import os
+import sys
+import json
+import subprocess
+
+prj_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds allowed to import monet and monet.reconstruct in a fresh interpreter, numpy included
+IMPORT_BUDGET = 0.5
+
+
+def test_import_time():
+    code = """
+import sys, time, json
+t0 = time.perf_counter()
+import monet
+import monet.reconstruct
+elapsed = time.perf_counter() - t0
+heavy = [m for m in ("scipy", "numba", "joblib", "yaml") if m in sys.modules]
+print(json.dumps({"elapsed": elapsed, "heavy": heavy}))
+"""
+    out = subprocess.run([sys.executable, "-c", code], cwd=prj_root, check=True, capture_output=True, text=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    assert result["heavy"] == [], "heavy modules imported eagerly: %s" % result["heavy"]
+    assert result["elapsed"] < IMPORT_BUDGET, "import took %.3f sec, budget is %.3f sec" % (
+        result["elapsed"], IMPORT_BUDGET)
@@ -0,0 +1,68 @@
+import os
+import sys
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.io import write_field, read_field
+
+
+@pytest.fixture
+def h5(tmp_path):
+    with h5py.File(str(tmp_path / "f.h5"), "w") as f:
+        yield f
+
+
+def _round_trip(tmp_path, data, precision, mode):
+    """write, close, and read back from the reopened file: the open file would serve HDF5's cached chunks"""
+    h5_file = str(tmp_path / "rt.h5")
+    with h5py.File(h5_file, "w") as f:
+        write_field(f, "z", data, precision=precision, mode=mode)
+    with h5py.File(h5_file, "r") as f:
+        return read_field(f, "z"), f["z"].attrs["error_bound"]
+
+
+@pytest.mark.parametrize("mode", ["scaleoffset", "quantize", "float16"])
+@pytest.mark.parametrize("magnitude, precision", [(100, 1e-5), (100, 1e-3), (10, 1e-6), (3, 1e-6), (1, 1e-3), (1, 1e-4),
+                                                  (0.1, 1e-5)])
+def test_error_within_recorded_bound(tmp_path, mode, magnitude, precision):
+    data = (np.random.RandomState(0).uniform(-1, 1, (200, 100)) * magnitude).astype(np.float32)
+    try:
+        decoded, error_bound = _round_trip(tmp_path, data, precision, mode)
+    except ValueError:
+        # the precision cannot be kept in this mode, nothing is written silently
+        return
+    assert np.abs(decoded.astype(np.float64) - data).max() <= error_bound <= precision
+
+
+def test_scaleoffset_beyond_float32_is_rejected(tmp_path):
+    # hdf5 scales in float32, values around 100 err by about 2e-5 whatever the digits kept
+    data = (np.random.RandomState(0).uniform(-1, 1, (200, 100)) * 100).astype(np.float32)
+    with pytest.raises(ValueError):
+        _round_trip(tmp_path, data, 1e-5, "scaleoffset")
+
+
+@pytest.mark.parametrize("mode", ["scaleoffset", "quantize"])
+def test_nan_is_kept_missing(tmp_path, mode):
+    data = np.random.RandomState(0).randn(50, 40).astype(np.float32)
+    data[0, 0] = data[10:20, 5] = np.nan
+    decoded, error_bound = _round_trip(tmp_path, data, 1e-4, mode)
+    assert np.array_equal(np.isnan(decoded), np.isnan(data))
+    assert np.nanmax(np.abs(decoded - data)) <= error_bound <= 1e-4
+
+
+@pytest.mark.parametrize("mode", ["scaleoffset", "quantize", "float16"])
+def test_infinite_values_are_rejected(h5, mode):
+    with pytest.raises(ValueError):
+        write_field(h5, "z", np.array([0., np.inf]), precision=1e-2, mode=mode)
+
+
+def test_float16_beyond_precision_is_rejected(h5):
+    with pytest.raises(ValueError):
+        write_field(h5, "z", np.array([0., 1e5]), precision=1e-2, mode="float16")
+    with pytest.raises(ValueError):
+        write_field(h5, "gx", np.array([0., 1000.1]), precision=1e-2, mode="float16")
+    ds = write_field(h5, "gy", np.array([0., 0.5, 1.]), precision=1e-2, mode="float16")
+    assert ds.attrs["error_bound"] == 0
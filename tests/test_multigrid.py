@@ -0,0 +1,27 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.multigrid import MultigridSolver, _laplacian, solve_compatibility_mf
+from monet.reconstruct import solve_compatibility
+
+
+def test_solves_laplacian():
+    rhs = np.random.RandomState(0).randn(3, 29, 17)
+    x = MultigridSolver(30, 18).solve(rhs)
+    assert np.allclose(_laplacian(x, 1., 1.), rhs, atol=1e-8)
+
+
+def test_no_iteration():
+    rhs = np.ones((19, 14))
+    assert np.all(MultigridSolver(20, 15, max_iter=0).solve(rhs) == 0)
+
+
+def test_matches_direct_solve():
+    rng = np.random.RandomState(0)
+    gX, gY = rng.randn(20, 15), rng.randn(20, 15)
+    mX, mY = solve_compatibility_mf(gX, gY)
+    eX, eY = solve_compatibility(gX, gY, strategy="lu")
+    assert np.allclose(mX, eX, atol=1e-5) and np.allclose(mY, eY, atol=1e-5)
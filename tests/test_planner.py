@@ -0,0 +1,57 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.planner import STRATEGIES, estimate, plan_solve
+
+
+@pytest.fixture(autouse=True)
+def no_env_override(monkeypatch):
+    monkeypatch.delenv("MONET_SOLVER", raising=False)
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_forced_strategy(strategy):
+    plan = plan_solve(60, 40, strategy=strategy, memory=1)
+    assert plan.strategy == strategy and plan.forced
+
+
+def test_environment_override(monkeypatch):
+    monkeypatch.setenv("MONET_SOLVER", "iterative")
+    plan = plan_solve(60, 40, memory=2 ** 40)
+    assert plan.strategy == "iterative" and plan.forced
+    # an explicit strategy wins over the environment
+    assert plan_solve(60, 40, strategy="lu").strategy == "lu"
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        plan_solve(60, 40, strategy="qr")
+
+
+def test_small_memory_falls_back_to_least_memory():
+    estimates = estimate(600, 100)
+    plan = plan_solve(600, 100, memory=1024)
+    assert not plan.forced
+    assert plan.strategy == min(STRATEGIES, key=lambda s: estimates[s]["memory"])
+
+
+def test_fastest_strategy_that_fits():
+    estimates = estimate(600, 100, n_frames=500)
+    plan = plan_solve(600, 100, n_frames=500, n_cores=1, memory=2 ** 40, memory_fraction=1.)
+    assert plan.strategy == min(STRATEGIES, key=lambda s: estimates[s]["time"])
+    assert np.isfinite(plan.memory_budget)
+
+
+def test_shared_factor_counts_once():
+    estimates = estimate(600, 100)
+    # room for the factor once, not once per worker
+    memory = 2 * estimates["reduced"]["memory"]
+    plan = plan_solve(600, 100, n_frames=500, n_workers=4, n_cores=4, memory=memory, memory_fraction=1.)
+    assert plan.strategy == "multigrid"
+    plan = plan_solve(600, 100, n_frames=500, n_workers=4, n_cores=4, memory=memory, memory_fraction=1.,
+                      shared_factor=True)
+    assert plan.strategy == "reduced"
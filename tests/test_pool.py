@@ -0,0 +1,46 @@
+import os
+import sys
+import shutil
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.pool import get_pool
+from monet.planner import plan_solve
+from monet.shared import export_factor
+
+
+def _worker_state(factor_dir=None):
+    from monet.kernels import integrate_stack, lu_solve
+    from monet.reconstruct import load_solver
+    with open("/proc/self/maps") as f:
+        n_mapped = sum(factor_dir in line for line in f) if factor_dir is not None else 0
+    return len(integrate_stack.signatures), len(lu_solve.signatures), load_solver.cache_info().currsize, n_mapped
+
+
+def _solve_frame(factor_dir):
+    from monet.reconstruct import solve_compatibility
+    from monet.shared import attach_factor
+    g = np.ones((12, 9))
+    return solve_compatibility(g, g, factor=attach_factor(factor_dir))[0].sum()
+
+
+def test_workers_start_warm():
+    factor_dir = export_factor(12, 9, strategy="reduced")
+    try:
+        pool = get_pool(n_jobs=1, factor_dir=factor_dir)
+        n_integrate, n_lu, n_solvers, _ = pool.submit(_worker_state).result()
+        assert n_integrate >= 2 and n_lu >= 1
+        # the shared factor replaces a per-worker solver
+        assert n_solvers == 0
+        pool.submit(_solve_frame, factor_dir).result()
+        # nothing keeps the factor mapped between frames, removing it frees /dev/shm
+        assert pool.submit(_worker_state, factor_dir).result()[3] == 0
+        pool.shutdown()
+
+        pool = get_pool(n_jobs=1, plan=plan_solve(12, 9, strategy="lu"))
+        n_integrate, n_lu, n_solvers, _ = pool.submit(_worker_state).result()
+        assert n_integrate >= 2 and n_solvers == 1
+        pool.shutdown()
+    finally:
+        shutil.rmtree(factor_dir)
@@ -0,0 +1,79 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.reconstruct import (INTEGRATION_PATHS, integrate, reconstruct, reconstruct_t, compatibility_residual,
+                               residual_stats)
+
+
+def _cumsum_reconstruct(gX, gY):
+    """reconstruct before the numba kernel"""
+    M = gX.shape[0]
+    N = gY.shape[1]
+    z0 = np.hstack([np.zeros(1), gY[0, :].cumsum()])
+    Z0 = np.vstack([z0] * M)[:, :N]
+    A = np.vstack([np.zeros((1, gX.shape[1])), gX.cumsum(axis=0)])[:M, :]
+    return (A + Z0).astype(np.float32)
+
+
+def _cumsum_reconstruct_t(gX, gY):
+    return _cumsum_reconstruct(gY.transpose(), gX.transpose()).transpose()
+
+
+def _gradients_of(Z):
+    """gradients that integrate exactly to Z - Z[0, 0]"""
+    gX = np.zeros(Z.shape)
+    gY = np.zeros(Z.shape)
+    gX[:-1, :] = np.diff(Z, axis=0)
+    gY[:, :-1] = np.diff(Z, axis=1)
+    return gX, gY
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_matches_cumsum(dtype):
+    rng = np.random.RandomState(0)
+    gX, gY = rng.randn(37, 23).astype(dtype), rng.randn(37, 23).astype(dtype)
+    atol = 0 if dtype == np.float64 else 1e-5
+    assert np.allclose(reconstruct(gX, gY), _cumsum_reconstruct(gX, gY), rtol=0, atol=atol)
+    assert np.allclose(reconstruct_t(gX, gY), _cumsum_reconstruct_t(gX, gY), rtol=0, atol=atol)
+
+
+def test_paths_recover_integrable_field():
+    Z = np.random.RandomState(1).randn(30, 20)
+    gX, gY = _gradients_of(Z)
+    expected = Z - Z[0, 0]
+    for p in INTEGRATION_PATHS:
+        assert np.allclose(integrate(gX, gY, paths=p), expected, atol=1e-5)
+    assert np.allclose(integrate(gX, gY, paths=INTEGRATION_PATHS), expected, atol=1e-5)
+
+
+def test_stack_matches_frames():
+    rng = np.random.RandomState(2)
+    gX, gY = rng.randn(4, 15, 11), rng.randn(4, 15, 11)
+    Z = integrate(gX, gY, paths=INTEGRATION_PATHS)
+    for f in range(4):
+        assert np.array_equal(Z[f], integrate(gX[f], gY[f], paths=INTEGRATION_PATHS))
+
+
+def test_residual_matches_per_pixel_formula():
+    rng = np.random.RandomState(3)
+    gX, gY = rng.randn(13, 9), rng.randn(13, 9)
+    R = compatibility_residual(gX, gY)
+    assert R.shape == (12, 8)
+    for i in range(12):
+        for j in range(8):
+            assert R[i, j] == gX[i, j] + gY[i + 1, j] - gX[i, j + 1] - gY[i, j]
+
+
+def test_residual_stats_of_stack_match_frames():
+    rng = np.random.RandomState(4)
+    gX, gY = rng.randn(3, 13, 9), rng.randn(3, 13, 9)
+    stats = residual_stats(gX, gY)
+    assert set(stats) == {"rms", "mean", "max", "p50", "p95", "p99"}
+    for f in range(3):
+        frame = residual_stats(gX[f], gY[f])
+        for k, v in frame.items():
+            assert np.isclose(stats[k][f], v, rtol=1e-12, atol=0)
@@ -0,0 +1,37 @@
+import os
+import sys
+import shutil
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet import shared
+from monet.reconstruct import load_solver, load_reduced_solver, solve_compatibility
+
+
+@pytest.mark.parametrize("strategy", ["lu", "reduced"])
+def test_export_matches_in_process(strategy):
+    rng = np.random.RandomState(0)
+    gX, gY = rng.randn(12, 9), rng.randn(12, 9)
+    factor_dir = shared.export_factor(12, 9, strategy=strategy)
+    try:
+        assert load_solver.cache_info().currsize == 0
+        assert load_reduced_solver.cache_info().currsize == 0
+        factor = shared.SharedFactor(factor_dir)
+        sX, sY = solve_compatibility(gX, gY, factor=factor)
+        eX, eY = solve_compatibility(gX, gY, strategy=strategy)
+        assert np.allclose(sX, eX, atol=1e-5) and np.allclose(sY, eY, atol=1e-5)
+    finally:
+        shutil.rmtree(factor_dir)
+
+
+def test_small_shm_falls_back_to_temp_dir(monkeypatch):
+    if not os.path.isdir("/dev/shm"):
+        pytest.skip("no /dev/shm")
+    monkeypatch.setattr(shared.shutil, "disk_usage", lambda path: shutil._ntuple_diskusage(64, 64, 0))
+    factor_dir = shared.export_factor(12, 9, strategy="lu")
+    try:
+        assert not factor_dir.startswith("/dev/shm")
+    finally:
+        shutil.rmtree(factor_dir)
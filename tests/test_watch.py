@@ -0,0 +1,58 @@
+import os
+import sys
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monet.watch import FrameWatcher
+
+
+def _write_grad(grad_dir, frm, gX, gY):
+    with h5py.File(os.path.join(grad_dir, "gradz%04d.h5" % frm), "w") as f:
+        f.create_dataset("gradz_x", data=gX)
+        f.create_dataset("gradz_y", data=gY)
+
+
+def test_background_frame_flattens_earlier_frames(tmp_path):
+    grad_dir = str(tmp_path / "grad")
+    os.makedirs(grad_dir)
+    rng = np.random.RandomState(0)
+    for frm in range(3):
+        _write_grad(grad_dir, frm, rng.randn(12, 9) * 1e-2 + 0.1, rng.randn(12, 9) * 1e-2 - 0.1)
+    # the corrupt frame must not stop the watcher
+    _write_grad(grad_dir, 3, rng.randn(12, 9), rng.randn(5, 4))
+
+    out_dir = str(tmp_path / "out")
+    watcher = FrameWatcher(grad_dir, out_dir, background=1, settle=0)
+    watcher.run(poll=0.01, idle_timeout=0.2)
+
+    assert watcher.done == {0, 1, 2, 3}
+    assert sorted(watcher.failed) == [3]
+    for frm in range(3):
+        assert os.path.exists(os.path.join(out_dir, "z_flat", "z_flat_%03d.h5" % frm))
+        with h5py.File(os.path.join(out_dir, "xdmf", "xdmf_%03d.h5" % frm), "r") as f:
+            with h5py.File(os.path.join(out_dir, "z_flat", "z_flat_%03d.h5" % frm), "r") as g:
+                assert np.allclose(f["Z"][()], g["z"][()])
+    with open(os.path.join(out_dir, "xdmf", "frames.xmf")) as f:
+        collection = f.read()
+    assert all(("xdmf_%03d.xmf" % frm) in collection for frm in range(3))
+    assert "xdmf_003.xmf" not in collection
+
+
+def test_reflattened_frames_stay_within_precision(tmp_path):
+    grad_dir = str(tmp_path / "grad")
+    os.makedirs(grad_dir)
+    rng = np.random.RandomState(0)
+    for frm in range(2):
+        _write_grad(grad_dir, frm, rng.randn(40, 30) * 0.3 + 0.5, rng.randn(40, 30) * 0.3 - 0.5)
+
+    exact = FrameWatcher(grad_dir, str(tmp_path / "exact"), background=1, settle=0, xdmf=False)
+    exact.run(poll=0.01, idle_timeout=0.2)
+    lossy = FrameWatcher(grad_dir, str(tmp_path / "lossy"), background=1, settle=0, xdmf=False, precision=1e-3)
+    lossy.run(poll=0.01, idle_timeout=0.2)
+
+    with h5py.File(str(tmp_path / "exact" / "z_flat" / "z_flat_000.h5"), "r") as f:
+        z = f["z"][()]
+    with h5py.File(str(tmp_path / "lossy" / "z_flat" / "z_flat_000.h5"), "r") as f:
+        assert np.abs(f["z"][()] - z).max() <= f["z"].attrs["error_bound"]
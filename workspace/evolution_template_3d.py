@@ -5,8 +5,6 @@ import logging
 import time
 
 import numpy as np
-from scipy.signal import savgol_filter
-from scipy.signal import find_peaks
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 from matplotlib.ticker import MaxNLocator
@@ -42,15 +40,76 @@ def draw_G(G, ax):
     return ax.contourf(X, Y, G.T, levels=levels, cmap=cmap)
 
 
+# follow two peaks through contraction then expansion, from their origins
+# returns the trajectories Y1, Y2 and their keyframes kp1, kp2 as (t, position, smoothed value) rows
+def track_peaks(G_hat, peaks_at, plt_config, origins, th, kfs):
+    s1 = origins[0]
+    s2 = origins[1]       
+    p1, Y1 = s1, []
+    p2, Y2 = s2, []
+    kp1 = {}
+    kp2 = {}
+    for t in range(plt_config["contraction_start"] - min(s1[0], s2[0]), plt_config["contraction_end"]):
+        Yhat = G_hat[:, t]
+        peaks = peaks_at[t]
+        if t >= plt_config["contraction_start"] + s1[0]:
+            pos = np.argmin(np.abs(peaks - p1[1]))
+            if len(p1) > 2 and np.abs(peaks[pos] - p1[1]) > th:
+                p1 = (t - plt_config["contraction_start"], p1[1], Yhat[p1[1]])
+            else:
+                p1 = (t - plt_config["contraction_start"], peaks[pos], Yhat[peaks[pos]])
+            Y1.append(p1)
+            if t - plt_config["contraction_start"] in kfs:
+                kp1[t - plt_config["contraction_start"]] = p1
+        if t >= plt_config["contraction_start"] + s2[0]:
+            pos = np.argmin(np.abs(peaks - p2[1]))
+            if len(p2) > 2 and np.abs(peaks[pos] - p2[1]) > th:
+                p2 = (t - plt_config["contraction_start"], p2[1], Yhat[p2[1]])
+            else:
+                p2 = (t - plt_config["contraction_start"], peaks[pos], Yhat[peaks[pos]])
+            Y2.append(p2)                
+            if t - plt_config["contraction_start"] in kfs:
+                kp2[t - plt_config["contraction_start"]] = p2
+    t_gap =  plt_config["expansion_start"] - plt_config["contraction_end"]
+    s1 = origins[2]
+    s2 = origins[3]
+    for t in range(plt_config["expansion_start"], plt_config["expansion_end"]):
+        Yhat = G_hat[:, t]
+        peaks = peaks_at[t]
+        if t <= plt_config["expansion_end"] - s1[0]:
+            pos = np.argmin(np.abs(peaks - p1[1]))
+            if len(p1) > 2 and np.abs(peaks[pos] - p1[1]) > th:
+                p1 = (t - plt_config["contraction_start"] - t_gap, p1[1], Yhat[p1[1]])
+            else:
+                p1 = (t - plt_config["contraction_start"] - t_gap, peaks[pos], Yhat[peaks[pos]])
+            Y1.append(p1)
+            if t - plt_config["contraction_start"] - t_gap in kfs:
+                kp1[t - plt_config["contraction_start"] - t_gap] = p1
+        if t <= plt_config["expansion_end"] - s2[0]:
+            pos = np.argmin(np.abs(peaks - p2[1]))
+            if len(p2) > 2 and np.abs(peaks[pos] - p2[1]) > th:
+                p2 = (t - plt_config["contraction_start"] - t_gap, p2[1], Yhat[p2[1]])
+            else:
+                p2 = (t - plt_config["contraction_start"] - t_gap, peaks[pos], Yhat[peaks[pos]])
+            Y2.append(p2)                
+            if t - plt_config["contraction_start"] - t_gap in kfs:
+                kp2[t - plt_config["contraction_start"] - t_gap] = p2     
+    return {"Y1": np.array(Y1), "Y2": np.array(Y2),
+            "kp1": np.array([kp1[t] for t in sorted(kp1)]), "kp2": np.array([kp2[t] for t in sorted(kp2)])}
+
+
 if __name__ == "__main__":
     from monet import init_logging
     from monet.io import read_center_line_h5
+    from monet.cache import AnalysisCache, prefetch_center_lines
     
     init_logging()
     data_root = os.path.join(workspace, "data", "20210106SiliconData")
     output_root = os.path.join(workspace, "output", "20210106SiliconData")
     output_img_dir = os.path.join(output_root, "img")
     create_output_dir(output_img_dir)
+    # smoothing, peak detection and tracking are cached, re-running only to restyle the figure just plots
+    cache = AnalysisCache(os.path.join(output_root, "cache"), max_bytes=2 * 2 ** 30)
 
     # convert folder name to strain rate
     def get_strain_rate(folder):
@@ -115,8 +174,12 @@ if __name__ == "__main__":
     length_scale = 0.325
     fps = 1
 
-    # for f in ["01", "05", "10", "15", "20", "25", "30", "35", "40", "45", "50", "55", "60"]:
-    for idx, f in enumerate(["01"]):
+    # folders = ["01", "05", "10", "15", "20", "25", "30", "35", "40", "45", "50", "55", "60"]
+    folders = ["01"]
+    # smooth and detect peaks of all strain rates in parallel, the loop below then reads them from the cache
+    prefetch_center_lines(cache, [os.path.join(data_root, f, f + ".h5") for f in folders], scale=2., window=51,
+                          polyorder=3, height=0.01, distance=50, mean="in_memory", n_jobs=4)
+    for idx, f in enumerate(folders):
         plt_config = {
             "folder": f,   # sub-folder, also use as the name of the test case
             "cl_h5": "",   # centerline h5
@@ -132,11 +195,8 @@ if __name__ == "__main__":
 
         centerline_h5 = os.path.join(data_root, plt_config["folder"], plt_config["cl_h5"])
         G = read_center_line_h5(centerline_h5, gx_ds="gx") * 2.
+        G_hat = cache.smoothed_center_line(centerline_h5, scale=2., window=51, polyorder=3)
 
-        s1 = peak_origins[plt_config["folder"]][0]
-        s2 = peak_origins[plt_config["folder"]][1]       
-        p1, Y1 = s1, []
-        p2, Y2 = s2, []
         th = 100
         if f == "01":
             th = 10
@@ -145,57 +205,20 @@ if __name__ == "__main__":
         if f == "50":
             th = 100
         kfs = [1500, 1375, 1270, 1150, 1000, 875, 750, 625, 491, 386, 250, 125, 0]
-        kp1 = {}
-        kp2 = {}
-        for t in range(plt_config["contraction_start"] - min(s1[0], s2[0]), plt_config["contraction_end"]):
-            Y = G[:, t]
-            Yhat = savgol_filter(Y, 51, 3)
-            peaks, _ = find_peaks(Yhat - G.mean(), height=0.01, distance=50)
-            if t >= plt_config["contraction_start"] + s1[0]:
-                pos = np.argmin(np.abs(peaks - p1[1]))
-                if len(p1) > 2 and np.abs(peaks[pos] - p1[1]) > th:
-                    p1 = (t - plt_config["contraction_start"], p1[1], Yhat[p1[1]])
-                else:
-                    p1 = (t - plt_config["contraction_start"], peaks[pos], Yhat[peaks[pos]])
-                Y1.append(p1)
-                if t - plt_config["contraction_start"] in kfs:
-                    kp1[t - plt_config["contraction_start"]] = p1
-            if t >= plt_config["contraction_start"] + s2[0]:
-                pos = np.argmin(np.abs(peaks - p2[1]))
-                if len(p2) > 2 and np.abs(peaks[pos] - p2[1]) > th:
-                    p2 = (t - plt_config["contraction_start"], p2[1], Yhat[p2[1]])
-                else:
-                    p2 = (t - plt_config["contraction_start"], peaks[pos], Yhat[peaks[pos]])
-                Y2.append(p2)                
-                if t - plt_config["contraction_start"] in kfs:
-                    kp2[t - plt_config["contraction_start"]] = p2
-        t_gap =  plt_config["expansion_start"] - plt_config["contraction_end"]
-        s1 = peak_origins[plt_config["folder"]][2]
-        s2 = peak_origins[plt_config["folder"]][3]
-        for t in range(plt_config["expansion_start"], plt_config["expansion_end"]):
-            Y = G[:, t]
-            Yhat = savgol_filter(Y, 51, 3)
-            peaks, _ = find_peaks(Yhat - G.mean(), height=0.01, distance=50)
-            if t <= plt_config["expansion_end"] - s1[0]:
-                pos = np.argmin(np.abs(peaks - p1[1]))
-                if len(p1) > 2 and np.abs(peaks[pos] - p1[1]) > th:
-                    p1 = (t - plt_config["contraction_start"] - t_gap, p1[1], Yhat[p1[1]])
-                else:
-                    p1 = (t - plt_config["contraction_start"] - t_gap, peaks[pos], Yhat[peaks[pos]])
-                Y1.append(p1)
-                if t - plt_config["contraction_start"] - t_gap in kfs:
-                    kp1[t - plt_config["contraction_start"] - t_gap] = p1
-            if t <= plt_config["expansion_end"] - s2[0]:
-                pos = np.argmin(np.abs(peaks - p2[1]))
-                if len(p2) > 2 and np.abs(peaks[pos] - p2[1]) > th:
-                    p2 = (t - plt_config["contraction_start"] - t_gap, p2[1], Yhat[p2[1]])
-                else:
-                    p2 = (t - plt_config["contraction_start"] - t_gap, peaks[pos], Yhat[peaks[pos]])
-                Y2.append(p2)                
-                if t - plt_config["contraction_start"] - t_gap in kfs:
-                    kp2[t - plt_config["contraction_start"] - t_gap] = p2     
-        Y1 = np.array(Y1)
-        Y2 = np.array(Y2)
+        track_params = {"config": plt_config, "origins": peak_origins[plt_config["folder"]], "th": th, "kfs": kfs,
+                        "scale": 2., "window": 51, "polyorder": 3, "height": 0.01, "distance": 50}
+
+        def track():
+            peak_tab = cache.center_line_peaks(centerline_h5, scale=2., window=51, polyorder=3, height=0.01,
+                                               distance=50, mean="in_memory")
+            # peak positions of every time step, the table is sorted by t
+            peaks_at = np.split(peak_tab["pos"], np.searchsorted(peak_tab["t"], np.arange(1, G.shape[1])))
+            return track_peaks(G_hat, peaks_at, plt_config, peak_origins[plt_config["folder"]], th, kfs)
+        traj = cache.trajectory(centerline_h5, track_params, track)
+        Y1, Y2 = traj["Y1"], traj["Y2"]
+        kp1 = {int(p[0]): tuple(p) for p in traj["kp1"]}
+        kp2 = {int(p[0]): tuple(p) for p in traj["kp2"]}
+        t_gap = plt_config["expansion_start"] - plt_config["contraction_end"]
 
         # ax.plot(Y1[:, 1] * length_scale, Y1[:, 0] / fps, Y1[:, 2], color='tab:blue')
         # ax.plot(Y2[:, 1] * length_scale, Y2[:, 0] / fps, Y2[:, 2], color='tab:green')                
@@ -234,11 +257,12 @@ if __name__ == "__main__":
         for ik, t in enumerate(kfs):
             if t < plt_config["contraction_end"] - plt_config["contraction_start"]:
                 Z = G[:, plt_config["contraction_start"] + t]
+                Zhat = G_hat[:, plt_config["contraction_start"] + t]
             else:
                 Z = G[:, plt_config["contraction_start"] + t + t_gap]
+                Zhat = G_hat[:, plt_config["contraction_start"] + t + t_gap]
             Y = t * np.ones(Z.shape)
             X = np.arange(600)        
-            Zhat = savgol_filter(Z, 51, 3)
 
             tc = 'tab:gray'
             if t in [491, 386]:
@@ -5,31 +5,56 @@ import logging
 import time
 
 from shutil import rmtree
-from joblib import Parallel, delayed
+from functools import partial
 
 _logger = logging.getLogger(__name__)
+# absolute precision kept for stored z/gx/gy (e.g. 1e-5), None for full float32
+PRECISION = None
 workspace = os.path.dirname(os.path.abspath(__file__))
 prj_root = os.path.dirname(workspace)
 sys.path.insert(0, prj_root)
 
-from monet.io import read_h5
-from monet.reconstruct import solve_compatibility, reconstruct
+from monet import init_logging
+from monet.io import read_h5, write_field
+from monet.planner import plan_solve
+from monet.pool import get_pool
+from monet.reconstruct import solve_compatibility, reconstruct, residual_stats
+from monet.shared import export_factor, attach_factor
 from monet.xdmf import z_file_to_xdmf
 
 
-def reconstruct_frm(grad_dir, z_dir, frm):
+def reconstruct_frm(grad_dir, z_dir, frm, residual_tol=None, factor_dir=None, plan=None):
+    """
+    residual_tol: skip solving compatibility if the rms residual of the raw gradients is already below it
+    factor_dir: a factor exported by export_factor, shared by all workers instead of one factor per worker
+    plan: the run's SolvePlan, used when there is no shared factor
+    """
     init_logging()
     t0 = time.time()
     grad_h5 = os.path.join(grad_dir, "gradz%04d.h5" % frm)
     z_h5 = os.path.join(z_dir, "z_%03d.h5" % frm)
     if not os.path.exists(z_h5):
         gX, gY = read_h5(grad_h5, gx_ds="gradz_x", gy_ds="gradz_y")
-        gX, gY = solve_compatibility(gX, gY)
+        raw_stats = residual_stats(gX, gY)
+        if residual_tol is not None and raw_stats["rms"] < residual_tol:
+            _logger.info("Skip solving frame %d, residual rms %.3e < %.3e" % (frm, raw_stats["rms"], residual_tol))
+            solved_stats = raw_stats
+        else:
+            factor = attach_factor(factor_dir) if factor_dir is not None else None
+            gX, gY = solve_compatibility(gX, gY, plan=plan, factor=factor)
+            solved_stats = residual_stats(gX, gY)
+        _logger.info("Frame %d residual rms %.3e -> %.3e, max %.3e -> %.3e" % (
+            frm, raw_stats["rms"], solved_stats["rms"], raw_stats["max"], solved_stats["max"]))
         Z = reconstruct(gX, gY)
         with h5py.File(z_h5, 'w') as h5:
-            h5.create_dataset("z", data=Z)
-            h5.create_dataset("gx", data=gX)
-            h5.create_dataset("gy", data=gY)
+            write_field(h5, "z", Z, precision=PRECISION)
+            # flatten_frm integrates these again, keep them exact so its errors stay within PRECISION
+            write_field(h5, "gx", gX)
+            write_field(h5, "gy", gY)
+            for k, v in raw_stats.items():
+                h5.attrs["raw_residual_%s" % k] = v
+            for k, v in solved_stats.items():
+                h5.attrs["residual_%s" % k] = v
     _logger.info("Reconstructed frame %d using %.2f sec" % (frm, time.time() - t0))
 
 
@@ -44,22 +69,20 @@ def flatten_frm(z_dir, z_flat_dir, frm, gX_bg, gY_bg):
         gY -= gY_bg
         Z = reconstruct(gX, gY)
         with h5py.File(z_flat_h5, 'w') as h5:
-            h5.create_dataset("z", data=Z)
-            h5.create_dataset("gx", data=gX)
-            h5.create_dataset("gy", data=gY)
+            write_field(h5, "z", Z, precision=PRECISION)
+            write_field(h5, "gx", gX, precision=PRECISION)
+            write_field(h5, "gy", gY, precision=PRECISION)
     _logger.info("Flattened frame %d using %.2f sec" % (frm, time.time() - t0))
 
 
 def frm_to_xdmf(z_dir, z_prefix, xdmf_dir, frm):
     init_logging()
     z_file = os.path.join(z_dir, "%s_%03d.h5" % (z_prefix, frm))
-    xdmf_file, h5_file = z_file_to_xdmf(z_file, xdmf_dir, "xdmf_%03d" % frm)
+    xdmf_file, h5_file = z_file_to_xdmf(z_file, xdmf_dir, "xdmf_%03d" % frm, precision=PRECISION)
     _logger.info("Converted frame %d to XDMF format: %s, %s" % (frm, xdmf_file, h5_file))
 
 
 if __name__ == "__main__":
-    from monet import init_logging
-
     init_logging()
 
     data_root = os.path.join(workspace, "data", "microribbon")
@@ -75,7 +98,20 @@ if __name__ == "__main__":
     if not os.path.exists(z_dir):
         os.makedirs(z_dir, exist_ok=True)
 
-    Parallel(n_jobs=4)(delayed(reconstruct_frm)(grad_dir, z_dir, frm) for frm in range(n_files))
+    n_jobs = 4
+    # plan once for the whole run, then factorize once, all workers memory-map the same factor
+    gX0, _ = read_h5(os.path.join(grad_dir, "gradz%04d.h5" % 0), gx_ds="gradz_x", gy_ds="gradz_y")
+    plan = plan_solve(*gX0.shape, n_frames=n_files, n_workers=n_jobs, shared_factor=True)
+    _logger.info("Solving %d frames with %s" % (n_files, plan))
+    factor_dir = export_factor(*gX0.shape, strategy=plan.strategy, dtype=plan.dtype)
+
+    # workers start with the kernels loaded and the factor attached, and stay alive across the stages below
+    pool = get_pool(n_jobs=n_jobs, factor_dir=factor_dir)
+    try:
+        list(pool.map(partial(reconstruct_frm, grad_dir, z_dir, factor_dir=factor_dir, plan=plan), range(n_files)))
+    finally:
+        # do not leave the factor in /dev/shm if a frame fails
+        rmtree(factor_dir)
 
     # =====
     # flatten: remove a background gradient field
@@ -92,7 +128,7 @@ if __name__ == "__main__":
     if not os.path.exists(z_flat_dir):
         os.makedirs(z_flat_dir, exist_ok=True)
 
-    Parallel(n_jobs=4)(delayed(flatten_frm)(z_dir, z_flat_dir, frm, gX_bg, gY_bg) for frm in range(n_files))
+    list(pool.map(partial(flatten_frm, z_dir, z_flat_dir, gX_bg=gX_bg, gY_bg=gY_bg), range(n_files)))
 
     # =====
     # xdmf: convert to ParaView format
@@ -111,6 +147,6 @@ if __name__ == "__main__":
     # rng = range(n_files)
 
     if use_flatten:
-        Parallel(n_jobs=4)(delayed(frm_to_xdmf)(z_flat_dir, "z_flat", xdmf_dir, frm) for frm in rng)
+        list(pool.map(partial(frm_to_xdmf, z_flat_dir, "z_flat", xdmf_dir), rng))
     else:
-        Parallel(n_jobs=4)(delayed(frm_to_xdmf)(z_dir, "z", xdmf_dir, frm) for frm in rng)
+        list(pool.map(partial(frm_to_xdmf, z_dir, "z", xdmf_dir), rng))